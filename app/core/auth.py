@@ -1,38 +1,118 @@
+import math
+import secrets
+import time
 from datetime import datetime, timedelta
+from typing import Optional
 
-import jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.config import ACCESS_TOKEN_EXPIRE_MINUTES
-from app.config import SECRET_KEY, ALGORITHM
-from app.db import crud, database
+from app.config import ACCESS_TOKEN_EXPIRE_MINUTES, ADMIN_TOKEN, REVOCATION_CACHE_SIZE
+from app.config import SECRET_KEY, ALGORITHM, STATELESS_AUTH
+from app.core import events
+from app.core.cache import TTLCache
+from app.core.hashing import hash_password, verify_password  # noqa: F401
+from app.db import async_crud, database
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# user id -> lowest token version still accepted. Entries only need to outlive
+# the tokens they revoke, so they expire with the access token lifetime.
+revoked_users = TTLCache(REVOCATION_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
 
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# PyJWT is imported by the functions using it, so importing this module stays cheap
 
 
 def create_access_token(data: dict):
+    import jwt
+
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)
+def create_user_token(user) -> str:
+    """Issue a token carrying the claims needed for stateless authentication."""
+    return create_access_token(
+        data={"sub": user.username, "uid": user.id, "ver": user.token_version or 0}
+    )
+
+
+def token_claims(authorization: Optional[str]) -> Optional[dict]:
+    """Claims of the bearer token in an Authorization header, if it is valid.
+
+    Only the signature and expiry are checked; middleware uses this to tell
+    callers apart before the endpoint authenticates them properly.
+    """
+    import jwt
+
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+
+
+def revoke_tokens(user_id: int, min_version: float = math.inf):
+    """Reject this user's tokens older than ``min_version`` (all of them by default)."""
+    revoked_users.set(user_id, min_version)
+
+
+# Logging out in any worker revokes the tokens in every worker's cache
+events.hub.on(
+    "revoke", lambda event: revoke_tokens(event["user_id"], event["min_version"])
+)
+
+
+# Revocations published while this worker's event connection was down never
+# reached the cache, so tokens issued before it reconnected are checked
+# against the database until they expire.
+_revocations_missed_before = 0.0
+
+
+def _revocations_missed(event: dict):
+    global _revocations_missed_before
+    _revocations_missed_before = time.time()
+
+
+events.hub.on("resync", _revocations_missed)
+
+
+def _revocations_complete(payload: dict) -> bool:
+    """Whether every revocation that could apply to this token reached this worker."""
+    if not events.hub.connected:
+        return False
+    issued_at = payload.get("exp", 0) - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    return issued_at >= _revocations_missed_before
+
+
+def _is_revoked(user_id: int, version: int) -> bool:
+    return version < revoked_users.get(user_id, 0)
+
+
+def claims_revoked(claims: dict) -> bool:
+    """Whether this worker knows the token with these claims was revoked."""
+    user_id, version = claims.get("uid"), claims.get("ver")
+    return user_id is not None and version is not None and _is_revoked(user_id, version)
+
+
+async def get_current_user(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_db)
 ):
-    """Decode the token and retrieve the current user."""
+    """Decode the token and retrieve the current user.
+
+    With STATELESS_AUTH the verified ``uid``/``ver`` claims are trusted as long
+    as the user is not in the revocation cache, so no query is issued. Tokens
+    the cache may have missed a revocation for are still checked in the
+    database.
+    """
+    import jwt
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username = payload.get("sub")
@@ -40,11 +120,24 @@ def get_current_user(
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
             )
-        user = crud.get_user_by_username(db, username)
+        user_id, version = payload.get("uid"), payload.get("ver")
+        if user_id is not None and version is not None:
+            if _is_revoked(user_id, version):
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked"
+                )
+            if STATELESS_AUTH and _revocations_complete(payload):
+                return {"id": user_id, "username": username}
+
+        user = await async_crud.get_user_by_username(db, username)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
             )
+        if version is not None and version < (user.token_version or 0):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked"
+            )
         return {"id": user.id, "username": user.username}
     except jwt.ExpiredSignatureError:
         raise HTTPException(
@@ -54,3 +147,17 @@ def get_current_user(
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
         )
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    """Allow the request only if it carries the configured admin token.
+
+    Without an ADMIN_TOKEN the admin endpoints do not exist as far as callers
+    can tell.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token"
+        )
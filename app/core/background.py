@@ -0,0 +1,60 @@
+"""Periodic maintenance jobs started from the application lifespan."""
+
+import asyncio
+import logging
+import time
+
+from app.config import IDEMPOTENCY_PURGE_INTERVAL, LEDGER_COMPACT_INTERVAL
+from app.db import async_crud
+from app.db.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+LEDGER_COMPACT_BATCH = 1000
+
+
+async def compact_ledger():
+    """Fold every user's unapplied transactions into their balance snapshot."""
+    async with AsyncSessionLocal() as db:
+        while (
+            await async_crud.compact_ledger(db, LEDGER_COMPACT_BATCH)
+            == LEDGER_COMPACT_BATCH
+        ):
+            pass
+
+
+async def purge_idempotency_keys():
+    """Drop idempotency keys whose responses are no longer replayed."""
+    async with AsyncSessionLocal() as db:
+        await async_crud.purge_idempotency_keys(db, time.time())
+
+
+async def _run_every(interval: float, job):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception:
+            logger.exception("Background job %s failed", job.__name__)
+
+
+def start() -> list:
+    """Schedule the enabled jobs on the running loop and return their tasks."""
+    tasks = []
+    if LEDGER_COMPACT_INTERVAL > 0:
+        tasks.append(
+            asyncio.create_task(_run_every(LEDGER_COMPACT_INTERVAL, compact_ledger))
+        )
+    if IDEMPOTENCY_PURGE_INTERVAL > 0:
+        tasks.append(
+            asyncio.create_task(
+                _run_every(IDEMPOTENCY_PURGE_INTERVAL, purge_idempotency_keys)
+            )
+        )
+    return tasks
+
+
+async def stop(tasks: list):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """A bounded LRU mapping whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, self._clock() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ReadThroughCache:
+    """Hold one loaded value for ``ttl`` seconds and coalesce concurrent loads.
+
+    While a load is in flight every other caller awaits the same one, so a burst
+    of misses costs a single query. ``invalidate`` drops the value and makes any
+    load already in flight discard its (possibly stale) result.
+    """
+
+    def __init__(self, ttl: float, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._value = None
+        self._expires_at = None
+        self._generation = 0
+        self._inflight = None
+
+    async def get(self, load):
+        if self._expires_at is not None and self._expires_at > self._clock():
+            return self._value
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._load(load, self._generation))
+        # A caller going away must not cancel the load the others are awaiting
+        return await asyncio.shield(self._inflight)
+
+    async def _load(self, load, generation: int):
+        try:
+            value = await load()
+            if generation == self._generation:
+                self._value = value
+                self._expires_at = self._clock() + self.ttl
+            return value
+        finally:
+            if generation == self._generation:
+                self._inflight = None
+
+    def invalidate(self):
+        # Callers arriving from now on start a fresh load instead of joining
+        # one that may have read the old value
+        self._generation += 1
+        self._expires_at = None
+        self._inflight = None
@@ -0,0 +1,169 @@
+"""Pot draws from an auditable, per-worker random stream.
+
+Rolls are generated a block at a time: each block has a fresh 32-byte seed
+from ``os.urandom`` and its rolls are the SHAKE-256 output of that seed, read
+as little-endian unsigned 64-bit integers. Taking a roll is an index bump, so
+a draw costs O(1) and a batch of sends takes all its rolls in one go.
+
+Every block is logged with ``sha256(seed)`` as its commitment before any of
+its rolls is used, and every draw is logged with that commitment, its index
+in the block, the roll and the win probability. Once a block is used up its
+seed is logged too, so anyone can recompute the rolls and check that they
+match the commitment and the outcomes. A worker shutting down reveals the
+seed of the block it was using, so no draw is left unverifiable.
+
+That trail is the audit record, so it does not depend on how the process set
+up logging: ``configure_audit_log`` (called at startup with DRAW_AUDIT_LOG)
+gives the logger its own INFO handler.
+
+A roll wins when it is below ``probability * 2**64``. The probability rises
+with the pot by DRAW_WIN_PROBABILITY_PER_UNIT per unit of currency, up to
+DRAW_MAX_WIN_PROBABILITY.
+
+Setting DRAW_SEED derives every block seed from it, which makes the stream
+reproducible; that is for tests and replays, never for several workers.
+"""
+
+import hashlib
+import logging
+import os
+import sys
+import threading
+from array import array
+from typing import Callable, Optional
+
+from app.config import DRAW_BLOCK_SIZE, DRAW_MAX_WIN_PROBABILITY, DRAW_SEED
+from app.config import DRAW_WIN_PROBABILITY, DRAW_WIN_PROBABILITY_PER_UNIT
+
+logger = logging.getLogger(__name__)
+
+ROLL_RANGE = 2**64
+
+_audit_handler = None
+
+
+def configure_audit_log(target: str):
+    """Write the audit trail to ``target``: a file, ``"-"`` for stderr, or
+    nowhere but the logging configuration if empty."""
+    global _audit_handler
+    if _audit_handler is not None:
+        logger.removeHandler(_audit_handler)
+        _audit_handler.close()
+        _audit_handler = None
+    if not target:
+        return
+    if target == "-":
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        handler = logging.FileHandler(target)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    _audit_handler = handler
+
+
+def win_probability(pot_amount: int) -> float:
+    """Chance that a message wins a pot holding ``pot_amount``."""
+    return min(
+        DRAW_MAX_WIN_PROBABILITY,
+        DRAW_WIN_PROBABILITY + DRAW_WIN_PROBABILITY_PER_UNIT * pot_amount,
+    )
+
+
+def block_rolls(seed: bytes, size: int) -> array:
+    """The rolls of a block, for generating it and for checking it later."""
+    rolls = array("Q", hashlib.shake_256(seed).digest(8 * size))
+    if sys.byteorder == "big":
+        rolls.byteswap()
+    return rolls
+
+
+class DrawEngine:
+    def __init__(
+        self,
+        seed: Optional[bytes] = None,
+        block_size: int = DRAW_BLOCK_SIZE,
+        probability: Callable[[int], float] = win_probability,
+    ):
+        self.block_size = block_size
+        self.probability = probability
+        self._seed = seed
+        self._blocks = 0
+        self._block_seed = None
+        self._commitment = None
+        self._rolls = array("Q")
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _reveal(self):
+        if self._block_seed is not None:
+            logger.info(
+                "Draw block %s revealed: seed %s",
+                self._commitment,
+                self._block_seed.hex(),
+            )
+            self._block_seed = None
+
+    def _start_block(self):
+        self._reveal()
+        if self._seed is None:
+            block_seed = os.urandom(32)
+        else:
+            block_seed = hashlib.blake2b(
+                self._blocks.to_bytes(8, "big"), key=self._seed, digest_size=32
+            ).digest()
+        self._blocks += 1
+        self._block_seed = block_seed
+        self._commitment = hashlib.sha256(block_seed).hexdigest()
+        self._rolls = block_rolls(block_seed, self.block_size)
+        self._next = 0
+        logger.info("Draw block %s committed", self._commitment)
+
+    def _take(self, count: int) -> list:
+        """Reserve the next ``count`` rolls as (commitment, index, roll)."""
+        taken = []
+        with self._lock:
+            while len(taken) < count:
+                if self._next >= len(self._rolls):
+                    self._start_block()
+                end = min(len(self._rolls), self._next + count - len(taken))
+                taken.extend(
+                    (self._commitment, index, self._rolls[index])
+                    for index in range(self._next, end)
+                )
+                self._next = end
+        return taken
+
+    def _settle(self, commitment: str, index: int, roll: int, pot_amount: int):
+        probability = self.probability(pot_amount)
+        won = roll < probability * ROLL_RANGE
+        logger.info(
+            "Draw %s:%d roll %016x probability %.6f pot %d %s",
+            commitment,
+            index,
+            roll,
+            probability,
+            pot_amount,
+            "won" if won else "lost",
+        )
+        return won
+
+    def reveal(self):
+        """Reveal the current block's seed and start a fresh block on the next draw."""
+        with self._lock:
+            self._reveal()
+            self._rolls = array("Q")
+            self._next = 0
+
+    def draw(self, pot_amount: int) -> bool:
+        """Decide whether the sender wins a pot holding ``pot_amount``."""
+        ((commitment, index, roll),) = self._take(1)
+        return self._settle(commitment, index, roll, pot_amount)
+
+    def batch(self, count: int) -> Callable[[int], bool]:
+        """Reserve rolls for ``count`` messages and return a draw using them in turn."""
+        rolls = iter(self._take(count))
+        return lambda pot_amount: self._settle(*next(rolls), pot_amount)
+
+
+engine = DrawEngine(bytes.fromhex(DRAW_SEED) if DRAW_SEED else None)
@@ -0,0 +1,323 @@
+"""Broadcast hub for pot, win, balance and cache invalidation events.
+
+The crud layer stages small JSON-able dicts with ``stage`` and they are
+published when the transaction commits. Handlers registered with ``on`` keep
+per-worker caches coherent, and every open stream subscribed to the hub
+receives the events too. Delivery between processes goes through a pluggable
+backend:
+
+* ``MemoryBackend`` hands events straight back to this process's hub, which is
+  all a single worker (or the test suite) needs;
+* ``PostgresBackend`` sends them with ``pg_notify`` and receives every
+  worker's events with ``LISTEN`` on one dedicated asyncpg connection. If
+  that connection drops it reconnects with backoff, and since whatever was
+  published in between is lost, handlers registered for ``"resync"`` run so
+  each worker can stop trusting what it cached.
+
+Each subscriber has a bounded queue. A consumer that falls behind loses its
+oldest events rather than making the hub buffer without limit.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Optional
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.event import listens_for
+from sqlalchemy.orm import Session
+
+from app.config import EVENTS_BACKEND, EVENTS_CHANNEL, EVENTS_QUEUE_SIZE
+from app.config import STARTUP_RETRY_MAX
+from app.db.database import database_url
+
+logger = logging.getLogger(__name__)
+
+FIRST_RETRY = 0.5
+
+
+class MemoryBackend:
+    """Deliver events to the publishing process only."""
+
+    connected = True
+
+    async def start(self, deliver, resync=None):
+        self._deliver = deliver
+
+    async def publish(self, event: dict):
+        self._deliver(event)
+
+    async def stop(self):
+        pass
+
+
+class PostgresBackend:
+    """Fan events out to every worker with Postgres LISTEN/NOTIFY."""
+
+    def __init__(self, url: Optional[str] = None, channel: str = EVENTS_CHANNEL):
+        # None follows the app's database, whatever create_app pointed it at
+        self.url = url
+        self.channel = channel
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._reconnecting = None
+        self._stopping = False
+
+    @property
+    def connected(self) -> bool:
+        """Whether this worker is hearing every other worker's events."""
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def start(self, deliver, resync=None):
+        self._deliver, self._resync = deliver, resync
+        self._stopping = False
+        await self._connect()
+
+    async def _connect(self):
+        import asyncpg
+
+        # asyncpg takes a plain libpq URL, whatever driver SQLAlchemy uses
+        dsn = make_url(self.url or database_url()).set(drivername="postgresql")
+        conn = await asyncpg.connect(dsn.render_as_string(hide_password=False))
+        conn.add_termination_listener(self._on_termination)
+        await conn.add_listener(self.channel, self._on_notify)
+        self._conn = conn
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            self._deliver(json.loads(payload))
+        except ValueError:
+            logger.warning("Ignoring malformed event on %s", channel)
+
+    def _on_termination(self, conn):
+        if self._stopping or conn is not self._conn:
+            return
+        logger.warning("Lost the %s event connection, reconnecting", self.channel)
+        self._conn = None
+        self._reconnecting = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        delay = FIRST_RETRY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+            except Exception as exc:
+                logger.warning(
+                    "Event connection failed, retrying in %.1fs: %s",
+                    delay,
+                    str(exc) or type(exc).__name__,
+                )
+                delay = min(2 * delay, STARTUP_RETRY_MAX)
+            else:
+                logger.info("Reconnected to the %s event channel", self.channel)
+                if self._resync is not None:
+                    self._resync()
+                return
+
+    async def publish(self, event: dict):
+        # One connection cannot run two commands at once
+        async with self._lock:
+            if self._conn is None:
+                raise RuntimeError("Event backend is not connected")
+            await self._conn.execute(
+                "SELECT pg_notify($1, $2)", self.channel, json.dumps(event)
+            )
+
+    async def stop(self):
+        self._stopping = True
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+            self._reconnecting = None
+        # Let a notification being sent finish before the connection goes
+        async with self._lock:
+            if self._conn is not None:
+                await self._conn.close()
+                self._conn = None
+
+
+class EventHub:
+    def __init__(self, backend, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.backend = backend
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._handlers = {}
+        self._started = False
+        self._loop = None
+
+    async def start(self):
+        if not self._started:
+            self._loop = asyncio.get_running_loop()
+            await self.backend.start(self._dispatch, self._resync)
+            self._started = True
+
+    async def stop(self):
+        if self._started:
+            self._started = False
+            await self.backend.stop()
+
+    @property
+    def connected(self) -> bool:
+        """Whether events published by other workers are reaching this one."""
+        return self.backend.connected
+
+    def on(self, event_type: str, handler):
+        """Call ``handler(event)`` for every event of this type from any worker.
+
+        Handlers keep per-process state such as caches coherent, so they run
+        in this worker as soon as it publishes and again when the event comes
+        back through the backend; they must be idempotent and thread-safe.
+        """
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def publish(self, event: dict):
+        """Send an event to every handler and subscriber of every worker.
+
+        Safe to call from any thread, including commit hooks running inside
+        ``AsyncSession.run_sync``. Until the hub is started (by the application
+        lifespan) events only reach this process. Publishing never fails the
+        caller: a broken backend only costs the other workers this event.
+        """
+        if not self._started:
+            self._dispatch(event)
+            return
+        self._run_handlers(event)
+        if self._loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self._send(event), self._loop)
+
+    async def _send(self, event: dict):
+        try:
+            await self.backend.publish(event)
+        except Exception:
+            logger.exception("Could not publish %s event", event.get("type"))
+
+    def _run_handlers(self, event: dict):
+        for handler in self._handlers.get(event.get("type"), ()):
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("Handler for %s event failed", event.get("type"))
+
+    def _resync(self):
+        # Only this worker's handlers: its streams have nothing to show for it
+        self._run_handlers({"type": "resync"})
+
+    def _dispatch(self, event: dict):
+        self._run_handlers(event)
+        for subscription in list(self._subscribers):
+            subscription.offer(event)
+
+    def subscribe(self) -> "Subscription":
+        """Start receiving every event; close the subscription (or use it as a
+        context manager) to stop."""
+        subscription = Subscription(self)
+        self._subscribers.add(subscription)
+        return subscription
+
+
+class Subscription:
+    """A subscriber's bounded queue, fed from whichever thread publishes."""
+
+    def __init__(self, hub: EventHub):
+        self._hub = hub
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(hub.queue_size)
+
+    def offer(self, event: dict):
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event: dict):
+        if self._queue.full():
+            self._queue.get_nowait()
+        self._queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        return await self._queue.get()
+
+    def close(self):
+        self._hub._subscribers.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def pot_event(pot_amount: int) -> dict:
+    return {"type": "pot", "pot_amount": pot_amount}
+
+
+def balance_event(
+    user_id: int, balance: int, message_count: int = None, ledger_id: int = None
+) -> dict:
+    """``ledger_id`` is the user's newest ledger row; it orders their events."""
+    event = {"type": "balance", "user_id": user_id, "balance": balance}
+    if message_count is not None:
+        event["message_count"] = message_count
+    if ledger_id is not None:
+        event["ledger_id"] = ledger_id
+    return event
+
+
+def win_event(
+    user_id: int, amount: int, wins: int = None, ledger_id: int = None
+) -> dict:
+    """``ledger_id`` is the win's own ledger row; it orders the user's wins."""
+    event = {"type": "win", "user_id": user_id, "amount": amount}
+    if wins is not None:
+        event["wins"] = wins
+    if ledger_id is not None:
+        event["ledger_id"] = ledger_id
+    return event
+
+
+def user_event(user_id: int, username: str, balance: int) -> dict:
+    return {
+        "type": "user",
+        "user_id": user_id,
+        "username": username,
+        "balance": balance,
+    }
+
+
+def users_event() -> dict:
+    """Users were created in bulk; per-user state should be reloaded."""
+    return {"type": "users"}
+
+
+def revoke_event(user_id: int, min_version: int) -> dict:
+    return {"type": "revoke", "user_id": user_id, "min_version": min_version}
+
+
+def stage(db: Session, event: dict):
+    """Publish ``event`` once the transaction open on ``db`` commits.
+
+    Staged events are dropped on rollback, so nobody hears about a change
+    that never happened.
+    """
+    db.info.setdefault("staged_events", []).append(event)
+
+
+@listens_for(Session, "after_commit")
+def _publish_staged(session: Session):
+    for event in session.info.pop("staged_events", ()):
+        hub.publish(event)
+
+
+@listens_for(Session, "after_soft_rollback")
+def _discard_staged(session: Session, previous_transaction):
+    session.info.pop("staged_events", None)
+
+
+def _make_backend():
+    if EVENTS_BACKEND == "postgres":
+        return PostgresBackend()
+    if EVENTS_BACKEND == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown EVENTS_BACKEND {EVENTS_BACKEND!r}")
+
+
+hub = EventHub(_make_backend())
@@ -0,0 +1,110 @@
+"""Password hashing on a dedicated, size-bounded pool of worker processes.
+
+bcrypt is deliberately slow, so running it on the request threadpool lets a
+burst of logins starve every other endpoint. The pool runs it in separate
+processes and ``HASH_QUEUE_LIMIT`` caps how much work may wait for it; beyond
+that callers get a 503 instead of queueing indefinitely.
+"""
+
+import asyncio
+import time
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from app.config import BCRYPT_ROUNDS, HASH_QUEUE_LIMIT, HASH_WORKERS
+from app.core import metrics
+
+_context = None
+_executor = None
+_pending = 0
+
+
+def get_pwd_context():
+    """Build the passlib context on first use; passlib is slow to import."""
+    global _context
+    if _context is None:
+        from passlib.context import CryptContext
+
+        # Pinning min and max rounds to the configured cost makes stored hashes
+        # with any other cost report needs_update, so they are re-hashed on login.
+        _context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=BCRYPT_ROUNDS,
+            bcrypt__min_rounds=BCRYPT_ROUNDS,
+            bcrypt__max_rounds=BCRYPT_ROUNDS,
+        )
+    return _context
+
+
+def __getattr__(name):
+    if name == "pwd_context":
+        return get_pwd_context()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def hash_password(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+
+def verify_and_update(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """Verify a password and return a replacement hash if the cost changed."""
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
+
+
+def _get_executor():
+    """Create the process pool on first use; None falls back to the threadpool."""
+    global _executor
+    if _executor is None and HASH_WORKERS > 0:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        _executor = ProcessPoolExecutor(
+            max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+async def _submit(operation: str, fn, *args):
+    global _pending
+    if _pending >= HASH_QUEUE_LIMIT:
+        metrics.password_hash_rejected.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _pending += 1
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _pending -= 1
+        metrics.password_hash_duration.observe(
+            time.perf_counter() - start, operation=operation
+        )
+
+
+async def hash_password_async(password: str) -> str:
+    return await _submit("hash", hash_password, password)
+
+
+async def verify_and_update_async(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    return await _submit("verify", verify_and_update, plain_password, hashed_password)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,238 @@
+"""Idempotency-Key support for the endpoints that move money.
+
+A client that retries ``POST /currency/deduct``, ``/pot/contribute`` or
+``/messages/send`` (or ``/send-batch``) after a timeout sends the same
+``Idempotency-Key`` header as the first attempt. The first request to use a
+key claims it in the ``idempotency_keys`` table, runs, and stores its
+response; every later request with that key gets the stored response back,
+marked ``Idempotent-Replayed: true``, without touching the ledger again.
+
+Duplicates arriving while the first request is still running are coalesced:
+in the same worker they wait for its stored response (and claim the key
+themselves if it stored none), in another worker they get a 409 to retry
+shortly. Keys are scoped to the user in the bearer token and
+are purged after IDEMPOTENCY_TTL.
+
+The route's rate limits are charged before the key is claimed, so a caller
+over its limit costs no write. A stored response is only replayed to a
+token that still authenticates, so logging out also cuts off replays.
+
+The response is stored after the endpoint's own transaction commits, so a
+worker dying in between leaves a reservation without a response. Retries get
+409 until IDEMPOTENCY_LOCK_TIMEOUT passes and then run the request again.
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import NamedTuple, Optional
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import JSONResponse, Response
+
+from app.core.auth import get_current_user, token_claims
+from app.core.ratelimit import route_limits
+from app.db import async_crud
+from app.db.database import AsyncSessionLocal
+
+HEADER = b"idempotency-key"
+MAX_KEY_LENGTH = 255
+IDEMPOTENT_PATHS = frozenset(
+    {"/currency/deduct", "/pot/contribute", "/messages/send", "/messages/send-batch"}
+)
+# Responses meaning the request never ran, which a retry should run again
+_RETRYABLE = frozenset({401, 403, 408, 409, 429})
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: Optional[int]
+    body: Optional[str]
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for header, value in scope["headers"]:
+        if header == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _fingerprint(scope, body: bytes) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (scope["method"].encode(), scope["path"].encode()):
+        digest.update(part + b"\0")
+    digest.update(scope["query_string"] + b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def _error(status_code: int, detail: str, **headers) -> Response:
+    return JSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+
+
+def _rejection(exc: HTTPException) -> Response:
+    return _error(exc.status_code, exc.detail, **(exc.headers or {}))
+
+
+async def _authenticate(scope, db) -> Optional[Response]:
+    """None if the bearer token still authenticates, otherwise the rejection."""
+    _, _, token = _header(scope, b"authorization").partition(" ")
+    try:
+        await get_current_user(token, db)
+    except HTTPException as exc:
+        return _rejection(exc)
+    return None
+
+
+def _replay(stored: StoredResponse, fingerprint: str) -> Response:
+    if stored.status_code is None:
+        return _error(
+            status.HTTP_409_CONFLICT,
+            "A request with this Idempotency-Key is in progress",
+            **{"Retry-After": "1"},
+        )
+    if stored.fingerprint != fingerprint:
+        return _error(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            "Idempotency-Key was already used for a different request",
+        )
+    return Response(
+        stored.body,
+        status_code=stored.status_code,
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware replaying stored responses for repeated Idempotency-Keys."""
+
+    def __init__(self, app):
+        self.app = app
+        # (user id, key) -> future resolved with the leader's StoredResponse,
+        # or None if it stored nothing
+        self._inflight = {}
+
+    async def __call__(self, scope, receive, send):
+        key = self._key(scope)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            response = _error(
+                status.HTTP_400_BAD_REQUEST,
+                f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters",
+            )
+            await response(scope, receive, send)
+            return
+        claims = token_claims(_header(scope, b"authorization"))
+        user_id = claims.get("uid") if claims else None
+        if user_id is None:
+            # The endpoint will turn the request away without a usable token
+            await self.app(scope, receive, send)
+            return
+
+        for limit in route_limits(scope):
+            try:
+                await limit(Request(scope))
+            except HTTPException as exc:
+                await _rejection(exc)(scope, receive, send)
+                return
+
+        body = await _read_body(receive)
+        fingerprint = _fingerprint(scope, body)
+        slot = (user_id, key)
+        while slot in self._inflight:
+            stored = await asyncio.shield(self._inflight[slot])
+            if stored is not None:
+                async with AsyncSessionLocal() as db:
+                    response = await _authenticate(scope, db)
+                await (response or _replay(stored, fingerprint))(scope, receive, send)
+                return
+            # The leader released the key, so this request claims it like a retry
+
+        # Registered without an await since the check, so duplicates see it
+        future = self._inflight[slot] = asyncio.get_running_loop().create_future()
+        stored = None
+        try:
+            stored = await self._run(
+                scope, receive, send, user_id, key, body, fingerprint
+            )
+        finally:
+            del self._inflight[slot]
+            future.set_result(stored)
+
+    @staticmethod
+    def _key(scope) -> Optional[str]:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in IDEMPOTENT_PATHS
+        ):
+            return None
+        return _header(scope, HEADER)
+
+    async def _run(self, scope, receive, send, user_id, key, body, fingerprint):
+        """Claim the key and run the request, or replay whoever holds it.
+
+        Returns what duplicates in this worker should be answered with: the
+        holder's record or the response that was stored, or None when the key
+        was released without one.
+        """
+        async with AsyncSessionLocal() as db:
+            holder = await async_crud.claim_idempotency_key(
+                db, user_id, key, fingerprint, time.time()
+            )
+            rejection = None if holder is None else await _authenticate(scope, db)
+        if holder is not None:
+            stored = StoredResponse(**holder)
+            await (rejection or _replay(stored, fingerprint))(scope, receive, send)
+            return stored
+
+        status_code = 500
+        chunks = []
+        body_sent = False
+
+        async def receive_wrapper():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        completed = False
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+            completed = status_code < 500 and status_code not in _RETRYABLE
+        finally:
+            response_body = b"".join(chunks).decode()
+            async with AsyncSessionLocal() as db:
+                if completed:
+                    await async_crud.save_idempotent_response(
+                        db, user_id, key, status_code, response_body
+                    )
+                else:
+                    await async_crud.release_idempotency_key(db, user_id, key)
+        if not completed:
+            return None
+        return StoredResponse(fingerprint, status_code, response_body)
@@ -0,0 +1,185 @@
+"""In-memory leaderboards by balance, messages sent and pots won.
+
+Each ranking holds the exact top ``2 * LEADERBOARD_SIZE`` users of this
+worker's view. The crud layer already publishes every balance, message
+count and win total on commit. The hub hands those events to ``apply``,
+which moves one user per event in O(capacity). Reading a ranking copies its
+first entries and needs no query. Events reach a worker out of order (its
+own on commit, then everybody's again through the backend), so each carries
+the id of the user's newest ledger row and an older one is ignored.
+
+A ranking only stays exact while it knows nobody outside it can outrank its
+last entry. A user who drops below that entry leaves the ranking. If enough
+users leave that it cannot fill a full page, the next read reloads it. That
+read also happens lazily after startup and after bulk imports. It writes
+nothing: it ranks the top of each indexed snapshot column together with the
+users whose transactions the background compaction has not folded in yet.
+"""
+
+import asyncio
+import bisect
+import threading
+
+from app.config import LEADERBOARD_SIZE
+from app.core import events
+from app.core.cache import TTLCache
+from app.db import async_crud
+
+BOARDS = ("balance", "messages", "wins")
+# Seconds a username is remembered; names never change, this only bounds memory
+NAME_TTL = 24 * 3600
+# Seconds the last ledger id applied per user and ranking is remembered; late
+# events arrive well within it
+VERSION_TTL = 600
+
+
+class Ranking:
+    """The highest values of one ranking, best first and exact.
+
+    Any user not held ranks below the last entry, unless ``complete`` says
+    every user is held.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.complete = False
+        self._values = {}
+        self._order = []  # (-value, user_id), best first
+
+    def load(self, rows):
+        """Replace the contents with ``(user_id, value)`` rows from the database."""
+        self._values = {user_id: value for user_id, value in rows}
+        self._order = sorted((-value, user_id) for user_id, value in rows)
+        self.complete = len(rows) < self.capacity
+
+    def set(self, user_id: int, value: int):
+        old = self._values.pop(user_id, None)
+        if old is not None:
+            del self._order[bisect.bisect_left(self._order, (-old, user_id))]
+        entry = (-value, user_id)
+        # Users nobody holds all rank after the last entry
+        if not self.complete and (not self._order or entry > self._order[-1]):
+            return
+        bisect.insort(self._order, entry)
+        self._values[user_id] = value
+        if len(self._order) > self.capacity:
+            _, dropped = self._order.pop()
+            del self._values[dropped]
+            self.complete = False
+
+    def add(self, user_id: int, value: int):
+        """``set`` for a new user, unless a later change got here first."""
+        if user_id not in self._values:
+            self.set(user_id, value)
+
+    def top(self, limit: int) -> list:
+        return [(user_id, -value) for value, user_id in self._order[:limit]]
+
+    def covers(self, limit: int) -> bool:
+        return self.complete or len(self._order) >= limit
+
+
+class Leaderboard:
+    def __init__(self, size: int = LEADERBOARD_SIZE):
+        self.size = size
+        self.rankings = {board: Ranking(2 * size) for board in BOARDS}
+        self.names = TTLCache(8 * size, NAME_TTL)
+        # (board, user id) -> ledger id of the last value applied
+        self.versions = TTLCache(64 * size, VERSION_TTL)
+        self._loaded = False
+        # Events that arrive while a reload is reading the database
+        self._pending = None
+        self._lock = threading.Lock()
+        self._reload_lock = asyncio.Lock()
+
+    def invalidate(self):
+        """Reload every ranking from the database on the next read."""
+        self._loaded = False
+
+    def apply(self, event: dict):
+        """Fold one committed change into the rankings; safe to repeat."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(event)
+            self._apply(event)
+
+    def _newer(self, board: str, user_id: int, ledger_id) -> bool:
+        """Whether a value as of ``ledger_id`` is newer than the one applied."""
+        if ledger_id is None:
+            return True
+        if ledger_id <= self.versions.get((board, user_id), -1):
+            return False
+        self.versions.set((board, user_id), ledger_id)
+        return True
+
+    def _set(self, board: str, user_id: int, value: int, ledger_id):
+        if self._newer(board, user_id, ledger_id):
+            self.rankings[board].set(user_id, value)
+
+    def _apply(self, event: dict):
+        kind, user_id = event["type"], event.get("user_id")
+        ledger_id = event.get("ledger_id")
+        if kind == "users":
+            self.invalidate()
+        elif kind == "user":
+            self.names.set(user_id, event["username"])
+            # A new user has no ledger rows, so any other event is newer
+            initial = {"balance": event["balance"], "messages": 0, "wins": 0}
+            for board, value in initial.items():
+                if self._newer(board, user_id, 0):
+                    self.rankings[board].add(user_id, value)
+        elif kind == "balance":
+            self._set("balance", user_id, event["balance"], ledger_id)
+            if "message_count" in event:
+                self._set("messages", user_id, event["message_count"], ledger_id)
+        elif kind == "win" and "wins" in event:
+            self._set("wins", user_id, event["wins"], ledger_id)
+
+    def fresh(self, board: str, limit: int) -> bool:
+        return self._loaded and self.rankings[board].covers(limit)
+
+    async def _reload(self, db):
+        with self._lock:
+            self._pending = []
+        try:
+            tops = await async_crud.get_leaderboards(db, 2 * self.size)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for board, rows in tops.items():
+                self.rankings[board].load([(uid, value) for uid, _, value, _ in rows])
+                for user_id, username, _, ledger_id in rows:
+                    self.names.set(user_id, username)
+                    self.versions.set((board, user_id), ledger_id)
+            self._loaded = True
+            # Changes committed while the snapshots were read go on top
+            for event in self._pending:
+                self._apply(event)
+            self._pending = None
+
+    async def top(self, db, board: str, limit: int) -> list:
+        """The best ``limit`` users of ``board`` as (user_id, username, value)."""
+        if not self.fresh(board, limit):
+            async with self._reload_lock:
+                # Whoever held the lock may have reloaded already
+                if not self.fresh(board, limit):
+                    await self._reload(db)
+        with self._lock:
+            entries = self.rankings[board].top(limit)
+        names = {user_id: self.names.get(user_id) for user_id, _ in entries}
+        missing = [user_id for user_id, name in names.items() if name is None]
+        if missing:
+            # Users who entered through events from other workers' writes
+            found = await async_crud.get_usernames(db, missing)
+            for user_id, name in found.items():
+                self.names.set(user_id, name)
+            names.update(found)
+        return [(user_id, names.get(user_id), value) for user_id, value in entries]
+
+
+leaderboard = Leaderboard()
+for _event_type in ("user", "users", "balance", "win"):
+    events.hub.on(_event_type, leaderboard.apply)
+events.hub.on("resync", lambda event: leaderboard.invalidate())
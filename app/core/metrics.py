@@ -0,0 +1,278 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+A handful of counters, gauges and histograms cover the hot paths: request
+latency per route, SQL statements and time per request, password hashing
+and pot draws. Values live in this process only, so with several uvicorn
+workers each one reports its own series. When ``METRICS_ENABLED`` is off the
+middleware and engine hooks are never installed, leaving only a few counter
+increments on the request path.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0)
+
+_registry = []
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(
+                f"{self.name}{_format_labels(self.label_names, key)} "
+                f"{_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from ``function`` at scrape time instead."""
+        self._function = function
+
+    def render(self) -> list:
+        if self._function is not None:
+            self.set(self._function())
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts (last slot is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            items = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, key, le)} "
+                    f"{cumulative}"
+                )
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests handled.", ["method", "route", "status"]
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling HTTP requests.",
+    ["method", "route"],
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled.", ["method"]
+)
+db_statements_per_request = Histogram(
+    "db_statements_per_request",
+    "SQL statements executed while handling one HTTP request.",
+    ["route"],
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50),
+)
+db_time_per_request = Histogram(
+    "db_time_per_request_seconds",
+    "Time spent executing SQL while handling one HTTP request.",
+    ["route"],
+)
+db_query_duration = Histogram(
+    "db_query_duration_seconds", "Time spent executing a single SQL statement."
+)
+db_pool_checked_out = Gauge(
+    "db_pool_checked_out", "Connections currently checked out of the pool."
+)
+db_pool_checkout_wait = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time callers waited to check out a pooled connection.",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+password_hash_duration = Histogram(
+    "password_hash_duration_seconds",
+    "Time spent hashing or verifying a password, including queueing.",
+    ["operation"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+password_hash_rejected = Counter(
+    "password_hash_rejected_total",
+    "Hashing jobs turned away because the queue was full.",
+)
+pot_draws = Counter("pot_draws_total", "Pot draws by outcome.", ["outcome"])
+pot_payout = Counter("pot_payout_total", "Currency paid out of the pot to winners.")
+
+
+# Statement count and SQL time of the request being handled, shared by
+# reference with the greenlets SQLAlchemy runs sync code in.
+_request_db = contextvars.ContextVar("request_db", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    db_query_duration.observe(elapsed)
+    stats = _request_db.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+def instrument_engine(engine, pool_stats=None):
+    """Time every statement run on ``engine`` and report its pool usage."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    if hasattr(engine.pool, "checkedout"):
+        db_pool_checked_out.set_function(engine.pool.checkedout)
+    if pool_stats is not None:
+        pool_stats.subscribe(db_pool_checkout_wait.observe)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL usage per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats = [0, 0.0]
+        token = _request_db.set(stats)
+        http_requests_in_flight.inc(method=method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_flight.dec(method=method)
+            _request_db.reset(token)
+            # The matched route's template keeps label cardinality bounded
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            http_requests.inc(method=method, route=path, status=status_code)
+            http_request_duration.observe(elapsed, method=method, route=path)
+            db_statements_per_request.observe(stats[0], route=path)
+            db_time_per_request.observe(stats[1], route=path)
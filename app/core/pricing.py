@@ -0,0 +1,200 @@
+"""Message pricing.
+
+A schedule gives the price of a user's n-th message (counting from 1). The
+engine keeps the running total of a schedule in an ``array`` of 64-bit
+integers, so ``table[n]`` is the price of the first n messages and the price
+of any run of messages is one subtraction. The table is filled up front to
+PRICING_TABLE_SIZE and doubles whenever a longer run is asked for. Schedules
+whose price stops changing record the message it stops at as
+``constant_from``; the table never grows past it and later totals are worked
+out in closed form, so a user sending forever does not grow it forever.
+
+Four models can be picked with PRICING_MODEL:
+
+* ``linear``: PRICING_BASE, then PRICING_STEP more for each message;
+* ``tiered``: a fixed price per range of messages, from PRICING_TIERS;
+* ``exponential``: PRICING_BASE, multiplied by PRICING_FACTOR per message;
+* ``time_decay``: linear, but counting only the messages sent in the last
+  PRICING_DECAY_WINDOW seconds, so prices fall back as a user slows down.
+
+Every price is capped at PRICING_MAX_COST.
+"""
+
+import bisect
+import threading
+from array import array
+from typing import Callable, Optional
+
+from app.config import PRICING_BASE, PRICING_DECAY_WINDOW, PRICING_FACTOR
+from app.config import PRICING_MAX_COST, PRICING_MODEL, PRICING_STEP
+from app.config import PRICING_TABLE_SIZE, PRICING_TIERS
+
+Schedule = Callable[[int], int]
+
+
+def _settles(schedule: Schedule, rising: Optional[bool], max_cost: int) -> Schedule:
+    """Record on a monotone ``schedule`` the first message of its constant tail.
+
+    ``rising`` is None for a schedule that never changes. Clamped to
+    [0, max_cost], one that moves stays put once it reaches the bound it is
+    heading for.
+    """
+    bound = max(0, max_cost) if rising else 0
+
+    def settled(n: int) -> bool:
+        return rising is None or max(0, min(schedule(n), max_cost)) == bound
+
+    high = 1
+    while not settled(high):
+        high *= 2
+    low = high // 2 + 1
+    while low < high:
+        middle = (low + high) // 2
+        if settled(middle):
+            high = middle
+        else:
+            low = middle + 1
+    schedule.constant_from = high
+    return schedule
+
+
+def linear(base: int, step: int, max_cost: int = PRICING_MAX_COST) -> Schedule:
+    def price(n: int) -> int:
+        return max(0, min(base + step * (n - 1), max_cost))
+
+    return _settles(price, None if step == 0 else step > 0, max_cost)
+
+
+def tiered(spec: str) -> Schedule:
+    """Parse ``"from:cost,from:cost"`` into a schedule.
+
+    ``"1:5,10:10"`` prices messages 1 to 9 at 5 and every later one at 10.
+    """
+    tiers = sorted(
+        (int(start), int(cost))
+        for start, _, cost in (part.partition(":") for part in spec.split(","))
+    )
+    if not tiers or tiers[0][0] != 1:
+        raise ValueError(f"PRICING_TIERS must start at message 1, got {spec!r}")
+    starts = [start for start, _ in tiers]
+
+    def price(n: int) -> int:
+        return tiers[bisect.bisect_right(starts, n) - 1][1]
+
+    price.constant_from = starts[-1]
+    return price
+
+
+def exponential(base: int, factor: float, max_cost: int) -> Schedule:
+    def price(n: int) -> int:
+        try:
+            return min(round(base * factor ** (n - 1)), max_cost)
+        except OverflowError:
+            return max_cost
+
+    if factor <= 0:
+        # Alternating signs never settle
+        return price
+    # A base of zero or less clamps every price to 0
+    rising = None if base <= 0 or factor == 1 else factor > 1
+    return _settles(price, rising, max_cost)
+
+
+class PricingEngine:
+    """Price runs of messages from a precomputed cumulative cost table.
+
+    ``window`` is zero when prices follow a user's lifetime message count;
+    otherwise the caller must count only the messages sent in the last
+    ``window`` seconds.
+    """
+
+    def __init__(
+        self,
+        schedule: Schedule,
+        max_cost: int = PRICING_MAX_COST,
+        window: float = 0,
+        table_size: int = PRICING_TABLE_SIZE,
+    ):
+        self.schedule = schedule
+        self.max_cost = max_cost
+        self.window = window
+        # Past this message every price is the same, so the table stops there
+        self._constant_from = getattr(schedule, "constant_from", None)
+        self._table = array("q", [0])
+        self._lock = threading.Lock()
+        self._grow(max(1, table_size))
+
+    def _grow(self, size: int):
+        with self._lock:
+            table = self._table
+            if len(table) > size:
+                return
+            end = max(size, 2 * (len(table) - 1))
+            if self._constant_from is not None:
+                end = min(end, self._constant_from)
+            # Extend a copy and swap it in, so readers never see a half-built one
+            grown = array("q", table)
+            total = grown[-1]
+            for n in range(len(table), end + 1):
+                total += self._price(n)
+                grown.append(total)
+            self._table = grown
+
+    def _price(self, n: int) -> int:
+        # The cap also keeps the running totals within 64 bits
+        return max(0, min(self.schedule(n), self.max_cost))
+
+    def _cumulative(self, n: int) -> int:
+        settled = self._constant_from
+        if settled is not None and n > settled:
+            return self._cumulative(settled) + (n - settled) * self._price(settled)
+        if n >= len(self._table):
+            self._grow(n)
+        return self._table[n]
+
+    def cost(self, n: int) -> int:
+        """Price of the n-th message."""
+        return self._cumulative(n) - self._cumulative(n - 1)
+
+    def quote(self, sent: int, count: int) -> int:
+        """Total price of the next ``count`` messages after ``sent`` of them."""
+        return self._cumulative(sent + count) - self._cumulative(sent)
+
+    def affordable(self, sent: int, count: int, balance: int) -> int:
+        """How many of the next ``count`` messages ``balance`` pays for."""
+        end = sent + count
+        balance = max(0, balance)
+        settled = self._constant_from
+        if settled is None or end <= settled:
+            self._cumulative(end)
+            table = self._table
+            paid = bisect.bisect_right(table, table[sent] + balance, sent, end + 1)
+            return paid - sent - 1
+
+        # Search the table up to the constant tail, then divide by its price
+        head = self.affordable(sent, settled - sent, balance) if sent < settled else 0
+        start = sent + head
+        if start < settled:
+            return head
+        price = self._price(settled)
+        left = balance - self.quote(sent, head)
+        return head + (end - start if price == 0 else min(end - start, left // price))
+
+
+def make_engine() -> PricingEngine:
+    if PRICING_MODEL == "linear":
+        return PricingEngine(linear(PRICING_BASE, PRICING_STEP))
+    if PRICING_MODEL == "tiered":
+        return PricingEngine(tiered(PRICING_TIERS))
+    if PRICING_MODEL == "exponential":
+        return PricingEngine(
+            exponential(PRICING_BASE, PRICING_FACTOR, PRICING_MAX_COST)
+        )
+    if PRICING_MODEL == "time_decay":
+        return PricingEngine(
+            linear(PRICING_BASE, PRICING_STEP), window=PRICING_DECAY_WINDOW
+        )
+    raise ValueError(f"Unknown PRICING_MODEL {PRICING_MODEL!r}")
+
+
+engine = make_engine()
@@ -0,0 +1,184 @@
+"""Statistical profiler that can be switched on in a live worker.
+
+A daemon thread wakes every few milliseconds, reads the other threads' frames
+with ``sys._current_frames()`` and counts each stack. Nothing is traced, so
+the cost to the profiled code is the GIL time of one stack walk per sample.
+Output is in the collapsed format ("frame;frame;frame count" per line) read by
+flamegraph.pl, speedscope and inferno.
+
+Two modes are offered:
+
+* ``profile_process`` samples every thread of this worker for N seconds;
+* ``ProfilerMiddleware`` samples the event loop only while one request's
+  task is running, for requests carrying ``X-Profile: <ADMIN_TOKEN>``.
+"""
+
+import asyncio
+import os
+import secrets
+import sys
+import threading
+import uuid
+from collections import Counter
+from typing import Callable, Optional
+
+from app.config import ADMIN_TOKEN, PROFILE_MAX_SECONDS, PROFILING_ENABLED
+from app.core.cache import TTLCache
+
+PROFILE_HEADER = b"x-profile"
+# Label for samples taken while the profiled request was waiting on I/O,
+# another task or an executor (bcrypt, the threadpool)
+SUSPENDED = "<suspended>"
+# Concurrent per-request profiles; requests beyond this run unprofiled
+MAX_REQUEST_PROFILES = 4
+
+# profile id -> collapsed stacks of a finished per-request profile
+request_profiles = TTLCache(256, 600)
+
+_process_lock = threading.Lock()
+_request_slots = threading.BoundedSemaphore(MAX_REQUEST_PROFILES)
+
+
+class ProfilerBusy(Exception):
+    """Raised when a process-wide profile is already running."""
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def collapse(frame) -> str:
+    """Render a frame and its callers root first, separated by semicolons."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def render(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class Sampler(threading.Thread):
+    """Collect stack samples until stopped.
+
+    ``thread_id`` restricts sampling to one thread; ``accept`` is asked before
+    every sample and may veto it or replace the stack with a label.
+    """
+
+    def __init__(
+        self,
+        interval: float,
+        thread_id: Optional[int] = None,
+        accept: Optional[Callable[[], Optional[str]]] = None,
+    ):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.interval = interval
+        self.thread_id = thread_id
+        self.accept = accept
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stopped.wait(self.interval):
+            label = self.accept() if self.accept is not None else None
+            if label is not None:
+                self.stacks[label] += 1
+                continue
+            frames = sys._current_frames()
+            if self.thread_id is not None:
+                frame = frames.get(self.thread_id)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+                continue
+            for ident, frame in frames.items():
+                if ident == self.ident:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                thread_name = names.get(ident, str(ident))
+                self.stacks[f"{thread_name};{collapse(frame)}"] += 1
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self.join()
+        return self.stacks
+
+
+async def profile_process(seconds: float, interval: float) -> str:
+    """Sample every thread of this process for ``seconds`` seconds.
+
+    Only one process-wide profile may run at a time; a second caller gets
+    ``ProfilerBusy`` instead of doubling the sampling overhead.
+    """
+    if not _process_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        sampler = Sampler(interval)
+        sampler.start()
+        try:
+            await asyncio.sleep(min(seconds, PROFILE_MAX_SECONDS))
+        finally:
+            stacks = sampler.stop()
+        return render(stacks)
+    finally:
+        _process_lock.release()
+
+
+def _requested(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == PROFILE_HEADER:
+            # Constant time, like require_admin, so this unauthenticated
+            # header cannot be used to guess the token byte by byte
+            return bool(ADMIN_TOKEN) and secrets.compare_digest(
+                value.decode("latin-1").encode(), ADMIN_TOKEN.encode()
+            )
+    return False
+
+
+class ProfilerMiddleware:
+    """Profile individual requests that ask for it with the admin token.
+
+    The response carries an ``X-Profile-Id`` header; the stacks can be
+    fetched from ``GET /admin/profile/requests/{id}`` once it completes.
+    """
+
+    def __init__(self, app, interval: float = 0.001):
+        self.app = app
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not PROFILING_ENABLED
+            or scope["type"] != "http"
+            or not _requested(scope)
+            or not _request_slots.acquire(blocking=False)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        def accept():
+            # The loop thread runs other tasks too; keep only this request's
+            return None if asyncio.current_task(loop) is task else SUSPENDED
+
+        sampler = Sampler(self.interval, threading.get_ident(), accept)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_profiles.set(profile_id, render(sampler.stop()))
+            _request_slots.release()
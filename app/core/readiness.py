@@ -0,0 +1,118 @@
+"""Worker startup and the checks behind /readyz.
+
+The lifespan runs no DDL and opens no connection, so a worker answers
+/healthz as soon as it has imported, whether or not the database is up.
+``prepare`` runs in the background instead. It connects the event hub, warms
+DB_POOL_WARM pooled connections and checks, once, that the database is at the
+migration head. It retries with backoff until all of that succeeds. Until
+then /readyz answers 503, so the load balancer holds traffic back instead of
+the worker crashing. It answers 503 again whenever the database stops
+answering or the event backend is reconnecting.
+
+The schema itself is only ever changed by ``alembic upgrade head``.
+"""
+
+import asyncio
+import logging
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from app.config import DB_POOL_WARM, READINESS_TIMEOUT, SCHEMA_CHECK
+from app.config import STARTUP_RETRY_MAX
+from app.core import events
+from app.db.database import get_async_engine
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = Path(__file__).resolve().parents[2] / "migrations"
+FIRST_RETRY = 0.5
+
+
+class SchemaMismatch(Exception):
+    """The database is not at the revision this code expects."""
+
+
+def head_revisions() -> set:
+    """Revisions ``alembic upgrade head`` would bring the database to."""
+    from alembic.script import ScriptDirectory
+
+    return set(ScriptDirectory(str(MIGRATIONS)).get_heads())
+
+
+async def check_schema(conn):
+    try:
+        rows = await conn.execute(text("SELECT version_num FROM alembic_version"))
+        current = set(rows.scalars())
+    except (OperationalError, ProgrammingError):
+        # No alembic_version table: never migrated at all
+        current = set()
+    # Reading the migration scripts touches the disk, so keep it off the loop
+    expected = await asyncio.to_thread(head_revisions)
+    if current != expected:
+        raise SchemaMismatch(
+            f"Database is at {', '.join(sorted(current)) or 'no revision'},"
+            f" expected {', '.join(sorted(expected))}; run alembic upgrade head"
+        )
+
+
+async def ping():
+    async with get_async_engine().connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+def _describe(exc: Exception) -> str:
+    return str(exc) or type(exc).__name__
+
+
+class Readiness:
+    def __init__(self):
+        self.ready = False
+        self.problem = "Starting"
+        self._schema_checked = not SCHEMA_CHECK
+
+    async def _prepare_once(self):
+        await events.hub.start()
+        # Held at the same time, so the pool keeps that many open
+        await asyncio.gather(*(ping() for _ in range(max(1, DB_POOL_WARM))))
+        if not self._schema_checked:
+            async with get_async_engine().connect() as conn:
+                await check_schema(conn)
+            self._schema_checked = True
+
+    async def prepare(self):
+        """Get this worker ready to serve, however long the database takes."""
+        delay = FIRST_RETRY
+        while True:
+            try:
+                await self._prepare_once()
+            except Exception as exc:
+                self.problem = _describe(exc)
+                logger.warning("Not ready, retrying in %.1fs: %s", delay, self.problem)
+                await asyncio.sleep(delay)
+                delay = min(2 * delay, STARTUP_RETRY_MAX)
+            else:
+                self.ready, self.problem = True, None
+                logger.info("Ready to serve")
+                return
+
+    async def probe(self) -> Optional[str]:
+        """None if this worker can serve traffic right now, otherwise why not."""
+        if not self.ready:
+            return self.problem
+        if not events.hub.connected:
+            return "Event backend disconnected"
+        try:
+            await asyncio.wait_for(ping(), READINESS_TIMEOUT)
+        except Exception as exc:
+            return f"Database unreachable: {_describe(exc)}"
+        return None
+
+
+readiness = Readiness()
+
+
+def start() -> asyncio.Task:
+    return asyncio.create_task(readiness.prepare())
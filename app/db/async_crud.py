@@ -0,0 +1,54 @@
+"""Async counterparts of the functions in app.db.crud.
+
+Each one runs the sync implementation through ``AsyncSession.run_sync``, so
+the query logic lives in a single place while connection I/O is awaited on
+the event loop instead of blocking a threadpool slot.
+"""
+
+import functools
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import crud
+
+InsufficientBalance = crud.InsufficientBalance
+calculate_message_cost = crud.calculate_message_cost
+
+
+def _run_sync(fn):
+    @functools.wraps(fn)
+    async def wrapper(db: AsyncSession, *args, **kwargs):
+        return await db.run_sync(fn, *args, **kwargs)
+
+    return wrapper
+
+
+get_user = _run_sync(crud.get_user)
+get_user_by_username = _run_sync(crud.get_user_by_username)
+update_user_password_hash = _run_sync(crud.update_user_password_hash)
+revoke_user_tokens = _run_sync(crud.revoke_user_tokens)
+create_user = _run_sync(crud.create_user)
+create_users = _run_sync(crud.create_users)
+get_user_balance = _run_sync(crud.get_user_balance)
+get_user_totals = _run_sync(crud.get_user_totals)
+update_user_balance = _run_sync(crud.update_user_balance)
+get_transactions = _run_sync(crud.get_transactions)
+compact_ledger = _run_sync(crud.compact_ledger)
+
+add_to_pot = _run_sync(crud.add_to_pot)
+update_pot = _run_sync(crud.update_pot)
+send_message = _run_sync(crud.send_message)
+send_message_batch = _run_sync(crud.send_message_batch)
+get_message_quote = _run_sync(crud.get_message_quote)
+take_rate_limit_token = _run_sync(crud.take_rate_limit_token)
+claim_idempotency_key = _run_sync(crud.claim_idempotency_key)
+save_idempotent_response = _run_sync(crud.save_idempotent_response)
+release_idempotency_key = _run_sync(crud.release_idempotency_key)
+purge_idempotency_keys = _run_sync(crud.purge_idempotency_keys)
+get_leaderboards = _run_sync(crud.get_leaderboards)
+get_usernames = _run_sync(crud.get_usernames)
+
+
+async def get_pot(db: AsyncSession) -> int:
+    """Read the pot total through the shared pot cache."""
+    return await crud.pot_cache.get(lambda: db.run_sync(crud.get_pot))
@@ -1,72 +1,841 @@
-from sqlalchemy.orm import Session
+from datetime import timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import case, delete, func, insert, select, union, update
+from sqlalchemy.orm import Session, load_only
+from app.config import IDEMPOTENCY_LOCK_TIMEOUT, IDEMPOTENCY_TTL
+from app.config import POT_CACHE_TTL, POT_SHARDS
+from app.core import events, pricing
+from app.core.cache import ReadThroughCache
 from app.db import models
 from app.schemas import user as user_schemas
 
 
+class InsufficientBalance(Exception):
+    """Raised when a user cannot afford the operation they requested."""
+
+
+def _remember_user(db: Session, user):
+    """Keep a loaded user alive for the rest of the session.
+
+    The session's identity map only holds weak references, so without this a
+    row loaded by one dependency is garbage collected and re-selected by the
+    next. Sessions are per request, which makes this a per-request cache.
+    """
+    if user is not None:
+        db.info.setdefault("users", {})[user.id] = user
+        db.info.setdefault("user_ids_by_username", {})[user.username] = user.id
+    return user
+
+
+def get_user(db: Session, user_id: int):
+    """Load a user by primary key, at most once per session."""
+    return _remember_user(db, db.get(models.User, user_id))
+
+
 def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+    """Load a user by username, at most once per session.
+
+    Only the columns login and token checks read are loaded, which Postgres
+    serves from the username index without visiting the table.
+    """
+    user_id = db.info.get("user_ids_by_username", {}).get(username)
+    if user_id is not None:
+        return get_user(db, user_id)
+    user = db.execute(
+        select(models.User)
+        .options(
+            load_only(
+                models.User.username,
+                *(getattr(models.User, name) for name in models.AUTH_COLUMNS),
+            )
+        )
+        .where(models.User.username == username)
+    ).scalar_one_or_none()
+    return _remember_user(db, user)
 
 
 def create_user(db: Session, user: user_schemas.UserCreate, hashed_password: str):
-    db_user = models.User(username=user.username, hashed_password=hashed_password)
-    db.add(db_user)
+    """Insert a user in one round trip unless the username is taken.
+
+    The unique index decides, so two concurrent registrations of one name
+    cannot both succeed. Returns the new row's id, username, token_version
+    and balance, or None if the name exists.
+    """
+    try:
+        created = db.execute(
+            _insert(db, models.User)
+            .values(username=user.username, hashed_password=hashed_password)
+            .on_conflict_do_nothing(index_elements=[models.User.username])
+            .returning(
+                models.User.id,
+                models.User.username,
+                models.User.token_version,
+                models.User.balance,
+            )
+        ).first()
+        if created is not None:
+            events.stage(
+                db, events.user_event(created.id, created.username, created.balance)
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return created
+
+
+def create_users(db: Session, users: list) -> int:
+    """Insert many users with one executemany, skipping taken usernames.
+
+    ``users`` holds dicts with ``username`` and ``hashed_password``. Returns
+    how many were created.
+    """
+    if not users:
+        return 0
+    try:
+        created = db.execute(
+            _insert(db, models.User)
+            .on_conflict_do_nothing(index_elements=[models.User.username])
+            .returning(models.User.id),
+            users,
+        ).all()
+        if created:
+            events.stage(db, events.users_event())
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(created)
+
+
+def update_user_password_hash(db: Session, user_id: int, hashed_password: str):
+    """Replace a user's stored password hash, e.g. after a bcrypt cost change."""
+    try:
+        db.execute(
+            update(models.User)
+            .where(models.User.id == user_id)
+            .values(hashed_password=hashed_password)
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def revoke_user_tokens(db: Session, user_id: int):
+    """Invalidate every token issued to a user and return the new token version."""
+    version = db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(token_version=models.User.token_version + 1)
+        .returning(models.User.token_version)
+    ).scalar()
+    if version is not None:
+        events.stage(db, events.revoke_event(user_id, version))
     db.commit()
-    db.refresh(db_user)
-    return db_user
+    return version
+
+
+def balance_expression():
+    """SQL expression for a user's balance: the snapshot plus unapplied deltas.
+
+    Balance changes are appended to the transactions table instead of
+    rewriting the users row; compact_ledger periodically folds them into
+    User.balance and advances User.ledger_cursor.
+    """
+    pending = (
+        select(func.sum(models.Transaction.delta))
+        .where(
+            models.Transaction.user_id == models.User.id,
+            models.Transaction.id > models.User.ledger_cursor,
+        )
+        .scalar_subquery()
+    )
+    return models.User.balance + func.coalesce(pending, 0)
+
+
+def message_count_expression():
+    """SQL expression for a user's message count: the snapshot plus unapplied
+    "message" rows.
+
+    Sends do not bump User.message_count. Each one already appends a
+    "message" row to the ledger while holding the user's row lock, so
+    counting those rows gives every send a correct, strictly increasing
+    count, and compact_ledger folds them into the snapshot in bulk.
+    """
+    pending = (
+        select(func.count(models.Transaction.id))
+        .where(
+            models.Transaction.user_id == models.User.id,
+            models.Transaction.id > models.User.ledger_cursor,
+            models.Transaction.reason == "message",
+        )
+        .scalar_subquery()
+    )
+    return models.User.message_count + pending
+
+
+def pot_wins_expression():
+    """SQL expression for the number of pots a user has won: the snapshot
+    plus unapplied "pot_win" rows, maintained like message_count_expression."""
+    pending = (
+        select(func.count(models.Transaction.id))
+        .where(
+            models.Transaction.user_id == models.User.id,
+            models.Transaction.id > models.User.ledger_cursor,
+            models.Transaction.reason == "pot_win",
+        )
+        .scalar_subquery()
+    )
+    return models.User.pot_wins + pending
+
+
+def _get_pot_wins(db: Session, user_id: int) -> int:
+    return db.execute(
+        select(pot_wins_expression()).where(models.User.id == user_id)
+    ).scalar()
 
 
 def get_user_balance(db: Session, user_id: int) -> int:
     """Retrieve the user's current balance."""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    return user.balance if user else None
+    return db.execute(
+        select(balance_expression()).where(models.User.id == user_id)
+    ).scalar()
+
+
+def get_user_totals(db: Session, user_id: int):
+    """Return a user's current (balance, message_count), or None."""
+    return db.execute(
+        select(balance_expression(), message_count_expression()).where(
+            models.User.id == user_id
+        )
+    ).first()
+
+
+def _lock_user(db: Session, user_id: int):
+    """Lock a user row and return its message count and current balance.
+
+    Every ledger insert for a user happens while holding this lock, which is
+    what lets compact_ledger fold a user's rows without missing any that are
+    still uncommitted.
+    """
+    return db.execute(
+        select(message_count_expression(), balance_expression())
+        .where(models.User.id == user_id)
+        .with_for_update()
+    ).first()
 
 
-def update_user_balance(db: Session, user_id: int, amount: int):
-    """Update the user's balance by adding or deducting an amount."""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        user.balance += amount
+def record_transaction(
+    db: Session, user_id: int, delta: int, reason: str, pot_id: int = None
+):
+    """Append a balance change inside the caller's transaction and return its id."""
+    return db.execute(
+        insert(models.Transaction)
+        .values(user_id=user_id, delta=delta, reason=reason, pot_id=pot_id)
+        .returning(models.Transaction.id)
+    ).scalar_one()
+
+
+def update_user_balance(
+    db: Session, user_id: int, amount: int, reason: str = "adjustment"
+) -> Optional[int]:
+    """Update the user's balance by adding or deducting an amount.
+
+    Returns the new balance, or None if the user does not exist. Raises
+    InsufficientBalance instead of letting the balance go negative.
+    """
+    try:
+        row = _lock_user(db, user_id)
+        if row is None:
+            db.rollback()
+            return None
+        balance = row[1] + amount
+        if balance < 0:
+            raise InsufficientBalance()
+        ledger_id = record_transaction(db, user_id, amount, reason)
+        events.stage(db, events.balance_event(user_id, balance, ledger_id=ledger_id))
         db.commit()
-        db.refresh(user)
-        return user
-    return None
+    except Exception:
+        db.rollback()
+        raise
+    return balance
+
+
+def get_transactions(
+    db: Session, user_id: int, limit: int, before_id: int = None
+) -> list:
+    """Return a user's transactions, newest first, older than ``before_id``."""
+    query = select(
+        models.Transaction.id,
+        models.Transaction.delta,
+        models.Transaction.reason,
+        models.Transaction.pot_id,
+        models.Transaction.created_at,
+    ).where(models.Transaction.user_id == user_id)
+    if before_id is not None:
+        query = query.where(models.Transaction.id < before_id)
+    query = query.order_by(models.Transaction.id.desc()).limit(limit)
+    return [dict(row._mapping) for row in db.execute(query)]
+
+
+def _has_unapplied_transactions():
+    """SQL condition: the user has ledger rows past their cursor."""
+    return (
+        select(models.Transaction.id)
+        .where(
+            models.Transaction.user_id == models.User.id,
+            models.Transaction.id > models.User.ledger_cursor,
+        )
+        .exists()
+    )
+
+
+def compact_ledger(db: Session, limit: int = 1000) -> int:
+    """Fold unapplied transactions into User.balance, User.message_count and
+    User.pot_wins for up to ``limit`` users.
+
+    Users are locked first (skipping any that are busy), so no sender can add
+    rows for them until the snapshot and cursor have moved. Returns the
+    number of users compacted.
+    """
+    try:
+        user_ids = (
+            db.execute(
+                select(models.User.id)
+                .where(_has_unapplied_transactions())
+                .order_by(models.User.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            .scalars()
+            .all()
+        )
+        if user_ids:
+            unapplied = (
+                models.Transaction.user_id == models.User.id,
+                models.Transaction.id > models.User.ledger_cursor,
+            )
+            db.execute(
+                update(models.User)
+                .where(models.User.id.in_(user_ids))
+                .values(
+                    balance=balance_expression(),
+                    message_count=message_count_expression(),
+                    pot_wins=pot_wins_expression(),
+                    ledger_cursor=select(func.max(models.Transaction.id))
+                    .where(*unapplied)
+                    .scalar_subquery(),
+                ),
+                execution_options={"synchronize_session": False},
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(user_ids)
+
+
+# Pot total served to readers; every committed pot write, in any worker,
+# invalidates it through its "pot" event
+pot_cache = ReadThroughCache(POT_CACHE_TTL)
+events.hub.on("pot", lambda event: pot_cache.invalidate())
+# Pot events may have been missed while the event connection was down
+events.hub.on("resync", lambda event: pot_cache.invalidate())
 
 
 def get_pot(db: Session) -> int:
-    """Retrieve the current pot amount."""
-    pot = db.query(models.Pot).first()
-    if not pot:
-        pot = models.Pot(amount=0)
-        db.add(pot)
+    """Retrieve the current pot amount, summed across all shards."""
+    return db.execute(
+        select(func.coalesce(func.sum(models.Pot.amount), 0))
+    ).scalar_one()
+
+
+def add_to_pot(db: Session, amount: int, shard_key: int = 0) -> int:
+    """Atomically add to the pot and return the new total."""
+    try:
+        _credit_pot(db, amount, shard_key)
+        total = get_pot(db)
+        events.stage(db, events.pot_event(total))
         db.commit()
-        db.refresh(pot)
-    return pot.amount
+    except Exception:
+        db.rollback()
+        raise
+    return total
 
 
-def update_pot(db: Session, amount: int):
-    """Add to the pot or reset it."""
-    pot = db.query(models.Pot).first()
-    if not pot:
-        pot = models.Pot(amount=amount)
-        db.add(pot)
-    else:
-        pot.amount = amount
-    db.commit()
-    db.refresh(pot)
-    return pot
+def drain_pot(db: Session) -> int:
+    """Empty every pot shard inside the caller's transaction.
 
+    All shards are locked before they are read, so contributions cannot slip in
+    between the read and the reset. They are locked in id order, so two
+    drains wait for each other instead of deadlocking. Only the shards that
+    were locked are reset: a shard created since then was not paid out, so
+    it keeps its amount. Returns the amount the shards held.
+    """
+    shards = db.execute(
+        select(models.Pot.id, models.Pot.amount)
+        .order_by(models.Pot.id)
+        .with_for_update()
+    ).all()
+    if shards:
+        db.execute(
+            update(models.Pot)
+            .where(models.Pot.id.in_([shard.id for shard in shards]))
+            .values(amount=0)
+        )
+    return sum(shard.amount for shard in shards)
 
-def increment_message_count(db: Session, user_id: int):
-    """Increment the message count for a user."""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user:
-        user.message_count += 1
+
+def update_pot(db: Session, amount: int) -> int:
+    """Set the pot to an exact amount, e.g. 0 to reset it."""
+    try:
+        drain_pot(db)
+        if amount:
+            _credit_pot(db, amount)
+        events.stage(db, events.pot_event(amount))
         db.commit()
-        db.refresh(user)
-        return user.message_count
-    return None
+    except Exception:
+        db.rollback()
+        raise
+    return amount
 
 
 def calculate_message_cost(message_count: int) -> int:
-    """Calculate the cost of the next message based on the user's message count."""
-    return 5 * message_count  # Example: Cost increases by 5 units per message
+    """Price of a user's ``message_count``-th message under the pricing engine."""
+    return pricing.engine.cost(message_count)
+
+
+def _recent_message_count(db: Session, user_id: int, seconds: float) -> int:
+    if db.get_bind().dialect.name == "sqlite":
+        cutoff = func.datetime("now", f"-{int(seconds)} seconds")
+    else:
+        cutoff = func.now() - timedelta(seconds=seconds)
+    return db.execute(
+        select(func.count())
+        .select_from(models.Transaction)
+        .where(
+            models.Transaction.user_id == user_id,
+            models.Transaction.reason == "message",
+            models.Transaction.created_at >= cutoff,
+        )
+    ).scalar()
+
+
+def _priced_count(db: Session, user_id: int, message_count: int) -> int:
+    """Messages the next price depends on: all of them, or only recent ones."""
+    if not pricing.engine.window:
+        return message_count
+    return _recent_message_count(db, user_id, pricing.engine.window)
+
+
+def get_message_quote(db: Session, user_id: int, count: int) -> Optional[dict]:
+    """Price the user's next ``count`` messages without writing anything."""
+    totals = get_user_totals(db, user_id)
+    if totals is None:
+        return None
+    balance, message_count = totals
+    priced = _priced_count(db, user_id, message_count)
+    return {
+        "message_count": message_count,
+        "count": count,
+        "next_cost": pricing.engine.cost(priced + 1),
+        "total_cost": pricing.engine.quote(priced, count),
+        "balance": balance,
+        "affordable": pricing.engine.affordable(priced, count, balance),
+    }
+
+
+def _insert(db: Session, model):
+    """Return a dialect-specific INSERT that supports ON CONFLICT."""
+    # The dialect packages load with the engine; importing them here too would
+    # only make importing crud slower
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects import sqlite
+
+        return sqlite.insert(model)
+    from sqlalchemy.dialects import postgresql
+
+    return postgresql.insert(model)
+
+
+def _pot_shard_id(shard_key: int) -> int:
+    return 1 + shard_key % POT_SHARDS
+
+
+def _credit_pot(db: Session, amount: int, shard_key: int = 0) -> int:
+    """Atomically add to one pot shard inside the caller's transaction.
+
+    The pot is spread over POT_SHARDS rows so concurrent writers increment
+    different rows instead of queueing on a single one. Returns the shard id.
+    """
+    pot_id = _pot_shard_id(shard_key)
+    stmt = _insert(db, models.Pot).values(id=pot_id, amount=amount)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[models.Pot.id],
+            set_={"amount": models.Pot.amount + stmt.excluded.amount},
+        )
+    )
+    return pot_id
+
+
+def send_message(
+    db: Session, user_id: int, draw: Callable[[int], bool]
+) -> Optional[dict]:
+    """Charge the next message, credit the pot and settle a win in one transaction.
+
+    The sender's row is locked for the whole transaction, so concurrent sends
+    from the same user serialize instead of losing updates. The charge and any
+    winnings are appended to the ledger. ``draw`` is called with the pot amount
+    including this message's cost and decides whether the user wins it. It is
+    drawn before the pot is touched: a winner takes the cost straight back
+    with the drained shards and a loser credits its own shard, so no sender
+    holds one shard while waiting for the others. Returns None if the user
+    does not exist and raises InsufficientBalance (leaving nothing written) if
+    the message is too expensive.
+    """
+    try:
+        row = _lock_user(db, user_id)
+        if row is None:
+            db.rollback()
+            return None
+
+        message_count, balance = row
+        cost = calculate_message_cost(_priced_count(db, user_id, message_count) + 1)
+        message_count += 1
+        if balance < cost:
+            raise InsufficientBalance()
+
+        balance -= cost
+        pot_amount = get_pot(db) + cost
+
+        won = draw(pot_amount)
+        if won:
+            pot_amount = drain_pot(db) + cost
+            # The cost went straight back to the winner, never into a shard
+            record_transaction(db, user_id, -cost, "message")
+            ledger_id = record_transaction(db, user_id, pot_amount, "pot_win")
+            balance += pot_amount
+            wins = _get_pot_wins(db, user_id)
+            events.stage(db, events.win_event(user_id, pot_amount, wins, ledger_id))
+        else:
+            pot_id = _credit_pot(db, cost, user_id)
+            ledger_id = record_transaction(db, user_id, -cost, "message", pot_id)
+
+        events.stage(
+            db, events.balance_event(user_id, balance, message_count, ledger_id)
+        )
+        events.stage(db, events.pot_event(0 if won else pot_amount))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {
+        "message_count": message_count,
+        "cost": cost,
+        "balance": balance,
+        "pot_amount": pot_amount,
+        "won": won,
+    }
+
+
+def send_message_batch(
+    db: Session, user_id: int, count: int, draw: Callable[[int], bool]
+) -> Optional[dict]:
+    """Send up to ``count`` messages from one user in a single transaction.
+
+    Messages are priced one after another along the pricing engine's
+    schedule and the batch stops at the first one the user can no longer
+    afford. The pot is drained under lock first, so every draw sees the pot
+    exactly as a run of single sends would, and whatever it holds after the
+    last message goes back into the sender's shard. Then the ledger rows are
+    written together. Returns None if the user does not exist and raises
+    InsufficientBalance if not even the first message is affordable.
+    """
+    try:
+        row = _lock_user(db, user_id)
+        if row is None:
+            db.rollback()
+            return None
+
+        message_count, balance = row
+        priced = _priced_count(db, user_id, message_count)
+        pot_amount = drain_pot(db)
+        results = []
+        for _ in range(count):
+            cost = calculate_message_cost(priced + len(results) + 1)
+            if balance < cost:
+                break
+            message_count += 1
+            balance -= cost
+            pot_amount += cost
+            won = draw(pot_amount)
+            results.append(
+                {
+                    "message_count": message_count,
+                    "cost": cost,
+                    "won": won,
+                    "pot_amount": pot_amount,
+                }
+            )
+            if won:
+                balance += pot_amount
+                pot_amount = 0
+        if not results:
+            raise InsufficientBalance()
+
+        total_cost = sum(result["cost"] for result in results)
+        wins = [i for i, result in enumerate(results) if result["won"]]
+        pot_id = _credit_pot(db, pot_amount, user_id) if pot_amount else None
+
+        ledger = []
+        for index, result in enumerate(results):
+            # Costs up to the last win were paid out; the rest are in the shard
+            paid_out = bool(wins) and index <= wins[-1]
+            ledger.append(
+                {
+                    "user_id": user_id,
+                    "delta": -result["cost"],
+                    "reason": "message",
+                    "pot_id": None if paid_out else pot_id,
+                }
+            )
+            if result["won"]:
+                ledger.append(
+                    {
+                        "user_id": user_id,
+                        "delta": result["pot_amount"],
+                        "reason": "pot_win",
+                        "pot_id": None,
+                    }
+                )
+        # Ids come from the sequence in row order, so sorting them lines them up
+        ledger_ids = sorted(
+            db.execute(
+                insert(models.Transaction).returning(models.Transaction.id), ledger
+            ).scalars()
+        )
+        if wins:
+            win_ids = [
+                ledger_id
+                for ledger_id, row in zip(ledger_ids, ledger)
+                if row["reason"] == "pot_win"
+            ]
+            first_win = _get_pot_wins(db, user_id) - len(wins) + 1
+            for number, index, ledger_id in zip(
+                range(first_win, first_win + len(wins)), wins, win_ids
+            ):
+                amount = results[index]["pot_amount"]
+                events.stage(db, events.win_event(user_id, amount, number, ledger_id))
+        events.stage(
+            db, events.balance_event(user_id, balance, message_count, ledger_ids[-1])
+        )
+        # Every shard was drained under lock, so this is the whole pot now
+        events.stage(db, events.pot_event(pot_amount))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {
+        "sent": len(results),
+        "total_cost": total_cost,
+        "balance": balance,
+        "pot_amount": pot_amount,
+        "results": results,
+    }
+
+
+def take_rate_limit_token(
+    db: Session, key: str, rate: float, burst: int, now: float
+) -> bool:
+    """Refill and take one token from a shared bucket in a single upsert.
+
+    The conflict branch only fires while the refilled bucket holds a whole
+    token, so an empty bucket is left untouched and nothing is returned.
+    """
+    bucket = models.RateLimit
+    refilled = bucket.tokens + (now - bucket.updated_at) * rate
+    refilled = case((refilled > burst, burst), else_=refilled)
+    try:
+        taken = db.execute(
+            _insert(db, bucket)
+            .values(key=key, tokens=burst - 1, updated_at=now)
+            .on_conflict_do_update(
+                index_elements=[bucket.key],
+                set_={"tokens": refilled - 1, "updated_at": now},
+                where=refilled >= 1,
+            )
+            .returning(bucket.key)
+        ).first()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return taken is not None
+
+
+def claim_idempotency_key(
+    db: Session, user_id: int, key: str, fingerprint: str, now: float
+) -> Optional[dict]:
+    """Reserve ``key`` for a request of this user, or report who holds it.
+
+    Returns None once the caller holds the key. Otherwise returns the holder's
+    ``fingerprint`` and stored ``status_code`` and ``body``; a NULL status
+    means that request is still running. Keys older than IDEMPOTENCY_TTL, and
+    reservations whose request died before IDEMPOTENCY_LOCK_TIMEOUT passed,
+    are taken over in the same upsert.
+    """
+    record = models.IdempotencyKey
+    reusable = (record.created_at < now - IDEMPOTENCY_TTL) | (
+        record.status_code.is_(None)
+        & (record.created_at < now - IDEMPOTENCY_LOCK_TIMEOUT)
+    )
+    try:
+        claimed = db.execute(
+            _insert(db, record)
+            .values(user_id=user_id, key=key, fingerprint=fingerprint, created_at=now)
+            .on_conflict_do_update(
+                index_elements=[record.user_id, record.key],
+                set_={
+                    "fingerprint": fingerprint,
+                    "status_code": None,
+                    "body": None,
+                    "created_at": now,
+                },
+                where=reusable,
+            )
+            .returning(record.key)
+        ).first()
+        holder = None
+        if claimed is None:
+            holder = db.execute(
+                select(record.fingerprint, record.status_code, record.body).where(
+                    record.user_id == user_id, record.key == key
+                )
+            ).first()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if claimed is not None:
+        return None
+    if holder is None:
+        # Purged between the two statements; report it as busy so the
+        # client retries rather than running unprotected
+        return {"fingerprint": fingerprint, "status_code": None, "body": None}
+    return holder._asdict()
+
+
+def save_idempotent_response(
+    db: Session, user_id: int, key: str, status_code: int, body: str
+):
+    """Store the response to replay for retries of a claimed key."""
+    record = models.IdempotencyKey
+    try:
+        db.execute(
+            update(record)
+            .where(record.user_id == user_id, record.key == key)
+            .values(status_code=status_code, body=body)
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def release_idempotency_key(db: Session, user_id: int, key: str):
+    """Give up a claimed key without a response, so a retry runs again."""
+    record = models.IdempotencyKey
+    try:
+        db.execute(
+            delete(record).where(
+                record.user_id == user_id,
+                record.key == key,
+                record.status_code.is_(None),
+            )
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def purge_idempotency_keys(db: Session, now: float) -> int:
+    """Delete keys past IDEMPOTENCY_TTL and return how many went."""
+    record = models.IdempotencyKey
+    try:
+        purged = db.execute(
+            delete(record).where(record.created_at < now - IDEMPOTENCY_TTL)
+        ).rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return purged
+
+
+# Snapshot column and current value behind each leaderboard ranking
+_RANKED_COLUMNS = {
+    "balance": (models.User.balance, balance_expression),
+    "messages": (models.User.message_count, message_count_expression),
+    "wins": (models.User.pot_wins, pot_wins_expression),
+}
+
+
+def get_leaderboards(db: Session, limit: int) -> dict:
+    """Top ``limit`` users of every ranking as (id, username, value, ledger id)
+    rows, by their current values.
+
+    A user without unapplied transactions is worth their snapshot, so only
+    the top of each indexed snapshot column and the users the background
+    compaction has not reached yet can make a ranking. The latter are found
+    once, by probing each user's newest ledger row, and every ranking then
+    orders just the union of the two by current value. Nothing is written.
+    """
+    pending = (
+        db.execute(select(models.User.id).where(_has_unapplied_transactions()))
+        .scalars()
+        .all()
+    )
+    # What the values include, so older events can be told apart
+    last_ledger_id = func.coalesce(
+        select(func.max(models.Transaction.id))
+        .where(models.Transaction.user_id == models.User.id)
+        .scalar_subquery(),
+        0,
+    )
+    boards = {}
+    for board, (column, current) in _RANKED_COLUMNS.items():
+        leaders = (
+            select(models.User.id)
+            .order_by(column.desc(), models.User.id)
+            .limit(limit)
+            .subquery()
+        )
+        candidates = union(
+            select(leaders.c.id),
+            select(models.User.id).where(models.User.id.in_(pending)),
+        )
+        value = current()
+        boards[board] = db.execute(
+            select(models.User.id, models.User.username, value, last_ledger_id)
+            .where(models.User.id.in_(candidates))
+            .order_by(value.desc(), models.User.id)
+            .limit(limit)
+        ).all()
+    return boards
+
+
+def get_usernames(db: Session, user_ids: list) -> dict:
+    """Map user ids to usernames."""
+    return dict(
+        db.execute(
+            select(models.User.id, models.User.username).where(
+                models.User.id.in_(user_ids)
+            )
+        ).all()
+    )
@@ -1,15 +1,199 @@
+import threading
+import time
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from app.config import DATABASE_URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from app.config import ASYNC_DATABASE_URL, DATABASE_URL, async_database_url
+from app.config import DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE
+from app.config import DB_POOL_SIZE, DB_POOL_TIMEOUT
+from app.config import DB_PGBOUNCER_MODE, DB_STATEMENT_TIMEOUT_MS
+
+
+class PoolCheckoutStats:
+    """Running totals of how long callers waited to check out a connection.
+
+    Observers added with ``subscribe`` are called with every wait as well.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._observers = []
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def subscribe(self, observer):
+        with self._lock:
+            if observer not in self._observers:
+                self._observers.append(observer)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            observers = list(self._observers)
+        for observer in observers:
+            observer(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "total_seconds": self.total_seconds,
+                "max_seconds": self.max_seconds,
+            }
+
+
+pool_checkout_stats = PoolCheckoutStats()
+
+
+def _timed(pool_class):
+    """Subclass a pool so every checkout records its wait time."""
+
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                pool_checkout_stats.record(time.perf_counter() - start)
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+def _engine_options(url: str, is_async: bool) -> dict:
+    """Build create_engine keyword arguments from the pool settings in app.config."""
+    driver = make_url(url).get_backend_name()
+    if driver == "sqlite":
+        return {}
+
+    connect_args = {}
+    if DB_PGBOUNCER_MODE:
+        options = {"poolclass": _timed(NullPool)}
+        if is_async:
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_cache_size"] = 0
+    else:
+        options = {
+            "poolclass": _timed(AsyncAdaptedQueuePool if is_async else QueuePool),
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+        }
+    options["pool_pre_ping"] = DB_POOL_PRE_PING
+
+    if DB_STATEMENT_TIMEOUT_MS:
+        if is_async:
+            connect_args["server_settings"] = {
+                "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)
+            }
+        else:
+            connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+_urls = {"sync": DATABASE_URL, "async": ASYNC_DATABASE_URL}
+_engines = {}
+_engines_lock = threading.Lock()
+_async_engine_hooks = []
+
+
+def configure(database_url: str, async_url: str = None):
+    """Point the engines at another database before they are first used.
+
+    The engines are shared by the whole process, so this retargets every
+    application in it. Once they exist, only the same URLs are accepted.
+    """
+    urls = {
+        "sync": database_url,
+        "async": async_url or async_database_url(database_url),
+    }
+    with _engines_lock:
+        if _engines and urls != _urls:
+            raise RuntimeError("The database engines were created already")
+        _urls.update(urls)
+
+
+def database_url() -> str:
+    return _urls["sync"]
+
+
+def get_engine():
+    """Sync engine for migrations, scripts and schema management."""
+    with _engines_lock:
+        if "sync" not in _engines:
+            url = _urls["sync"]
+            _engines["sync"] = create_engine(
+                url, **_engine_options(url, is_async=False)
+            )
+        return _engines["sync"]
+
+
+def get_async_engine():
+    """Async engine for the request path."""
+    with _engines_lock:
+        created = "async" not in _engines
+        if created:
+            url = _urls["async"]
+            _engines["async"] = create_async_engine(
+                url, **_engine_options(url, is_async=True)
+            )
+        engine = _engines["async"]
+    if created:
+        for hook in _async_engine_hooks:
+            hook(engine)
+    return engine
+
+
+def on_async_engine(hook):
+    """Call ``hook(engine)`` with the async engine once it exists."""
+    with _engines_lock:
+        if hook in _async_engine_hooks:
+            return
+        _async_engine_hooks.append(hook)
+        engine = _engines.get("async")
+    if engine is not None:
+        hook(engine)
+
+
+def __getattr__(name):
+    # Creating an engine loads its driver, so that waits until it is asked for
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class _LazySessionmaker(sessionmaker):
+    def __call__(self, **local_kw):
+        local_kw.setdefault("bind", get_engine())
+        return super().__call__(**local_kw)
+
+
+class _LazyAsyncSessionmaker(async_sessionmaker):
+    def __call__(self, **local_kw):
+        local_kw.setdefault("bind", get_async_engine())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = _LazySessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False
+)
+# Rows stay loaded after commit, so crud functions never need a refresh()
+AsyncSessionLocal = _LazyAsyncSessionmaker(autoflush=False, expire_on_commit=False)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
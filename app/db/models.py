@@ -1,17 +1,113 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import CheckConstraint, Column, DDL, DateTime, Float, ForeignKey
+from sqlalchemy import Index, Integer, String, Text, event, func, text
 from app.db.database import Base
 
+# Auth reads only these, so Postgres answers it from the username index alone
+AUTH_COLUMNS = ("id", "hashed_password", "token_version")
+
+
+def _fillfactor(table, percent: int):
+    """Leave free space in each page of a Postgres table for HOT updates.
+
+    An update that changes no indexed column can put the new row version in
+    the same page without touching any index, but only if the page has room.
+    """
+    event.listen(
+        table,
+        "after_create",
+        DDL(f"ALTER TABLE {table.name} SET (fillfactor = {percent})").execute_if(
+            dialect="postgresql"
+        ),
+    )
+
 
 class User(Base):
     __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    username = Column(String, unique=True, index=True, nullable=False)
+    id = Column(Integer, primary_key=True)
+    username = Column(String, nullable=False)
     hashed_password = Column(String, nullable=False)
-    balance = Column(Integer, default=100)
-    message_count = Column(Integer, default=0)  # Track the number of messages sent
+    # Snapshot of the balance up to ledger_cursor; see crud.balance_expression
+    balance = Column(Integer, nullable=False, default=100, server_default="100")
+    # Snapshots of messages sent and pots won, folded the same way
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    pot_wins = Column(Integer, nullable=False, default=0, server_default="0")
+    # Bumped to revoke issued tokens
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Last transaction folded into balance
+    ledger_cursor = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index(
+            "ix_users_username",
+            "username",
+            unique=True,
+            postgresql_include=list(AUTH_COLUMNS),
+        ),
+        # The ranked snapshots, for the leaderboard reload
+        Index("ix_users_balance", "balance"),
+        Index("ix_users_message_count", "message_count"),
+        Index("ix_users_pot_wins", "pot_wins"),
+        CheckConstraint("balance >= 0", name="ck_users_balance_nonnegative"),
+    )
 
 
 class Pot(Base):
     __tablename__ = "pot"
-    id = Column(Integer, primary_key=True, index=True)
-    amount = Column(Integer, default=0)  # Default pot amount is 0
+    # One row per shard, keyed 1..POT_SHARDS; see crud._credit_pot
+    id = Column(Integer, primary_key=True)
+    amount = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (CheckConstraint("amount >= 0", name="ck_pot_amount_nonnegative"),)
+
+
+# Every send rewrites a pot shard in place
+_fillfactor(Pot.__table__, 50)
+
+
+class Transaction(Base):
+    """Append-only record of every balance change."""
+
+    __tablename__ = "transactions"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    delta = Column(Integer, nullable=False)
+    reason = Column(String, nullable=False)  # e.g. "message", "pot_win"
+    pot_id = Column(Integer, nullable=True)  # Pot shard the money moved to
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_transactions_user_id_id", "user_id", "id"),
+        # Windowed pricing counts a user's recent sends
+        Index(
+            "ix_transactions_user_id_created_at",
+            "user_id",
+            "created_at",
+            postgresql_where=text("reason = 'message'"),
+            sqlite_where=text("reason = 'message'"),
+        ),
+    )
+
+
+class RateLimit(Base):
+    """Token bucket shared by all workers; see app.core.ratelimit."""
+
+    __tablename__ = "rate_limits"
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)  # Unix time of the last refill
+
+
+# Every rate-limited request rewrites its bucket in place
+_fillfactor(RateLimit.__table__, 80)
+
+
+class IdempotencyKey(Base):
+    """Response stored for a request sent with an Idempotency-Key header."""
+
+    __tablename__ = "idempotency_keys"
+    user_id = Column(Integer, primary_key=True)
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)  # Digest of method, path and body
+    status_code = Column(Integer, nullable=True)  # NULL while the request runs
+    body = Column(Text, nullable=True)
+    created_at = Column(Float, nullable=False, index=True)  # Unix time
@@ -0,0 +1,84 @@
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import HASH_WORKERS, PROFILE_MAX_SECONDS
+from app.core import hashing, profiler
+from app.core.auth import require_admin
+from app.db import async_crud
+from app.db.database import get_db
+from app.schemas.user import BulkUserCreate, BulkUserResult
+
+router = APIRouter(
+    prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)]
+)
+
+
+def _require_profiling():
+    if not profiler.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+
+
+@router.get("/profile", dependencies=[Depends(_require_profiling)])
+async def profile_worker(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+):
+    """Sample this worker's threads for a while and return collapsed stacks."""
+    try:
+        stacks = await profiler.profile_process(seconds, interval_ms / 1000)
+    except profiler.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(stacks)
+
+
+@router.get(
+    "/profile/requests/{profile_id}", dependencies=[Depends(_require_profiling)]
+)
+async def get_request_profile(profile_id: str):
+    """Return the collapsed stacks recorded for one X-Profile request."""
+    stacks = profiler.request_profiles.get(profile_id)
+    if stacks is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(stacks)
+
+
+async def _hash_all(passwords: set) -> dict:
+    """Hash each distinct password once, a pool's worth at a time."""
+    passwords = list(passwords)
+    chunk = max(HASH_WORKERS, 1)
+    hashes = {}
+    for start in range(0, len(passwords), chunk):
+        batch = passwords[start : start + chunk]
+        results = await asyncio.gather(*map(hashing.hash_password_async, batch))
+        hashes.update(zip(batch, results))
+    return hashes
+
+
+@router.post("/users/bulk", response_model=BulkUserResult)
+async def bulk_register(batch: BulkUserCreate, db: AsyncSession = Depends(get_db)):
+    """Create many users in one statement, e.g. to seed load tests or import
+    accounts with their existing hashes. Taken usernames are skipped."""
+    for user in batch.users:
+        if user.hashed_password is not None and not hashing.get_pwd_context().identify(
+            user.hashed_password
+        ):
+            raise HTTPException(
+                status_code=400, detail=f"Unrecognized hash for {user.username}"
+            )
+
+    hashes = await _hash_all(
+        {user.password for user in batch.users if user.password is not None}
+    )
+    created = await async_crud.create_users(
+        db,
+        [
+            {
+                "username": user.username,
+                "hashed_password": user.hashed_password or hashes[user.password],
+            }
+            for user in batch.users
+        ],
+    )
+    return {"created": created, "skipped": len(batch.users) - created}
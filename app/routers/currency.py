@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from app.db import crud
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import async_crud
 from app.db.database import get_db
+from app.schemas.currency import TransactionPage
 from app.schemas.user import UserBalance
 from app.core.auth import get_current_user
 
@@ -9,11 +12,11 @@ router = APIRouter(prefix="/currency", tags=["currency"])
 
 
 @router.get("/balance", response_model=UserBalance)
-def get_balance(
-    current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)
+async def get_balance(
+    current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)
 ):
     """Fetch the current balance of the logged-in user."""
-    user_balance = crud.get_user_balance(db, current_user["id"])
+    user_balance = await async_crud.get_user_balance(db, current_user["id"])
     if user_balance is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
@@ -22,17 +25,38 @@ def get_balance(
 
 
 @router.post("/deduct")
-def deduct_balance(
+async def deduct_balance(
     cost: int,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Deduct a specific amount of currency from the user's balance."""
-    user_balance = crud.get_user_balance(db, current_user["id"])
-    if user_balance is None or user_balance < cost:
+    try:
+        new_balance = await async_crud.update_user_balance(
+            db, current_user["id"], -cost
+        )
+    except async_crud.InsufficientBalance:
+        new_balance = None
+    if new_balance is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient balance"
         )
+    return {"message": "Currency deducted", "new_balance": new_balance}
+
+
+@router.get("/history", response_model=TransactionPage)
+async def get_history(
+    limit: int = Query(50, gt=0, le=500),
+    before: Optional[int] = None,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Page through the logged-in user's balance changes, newest first.
 
-    updated_user = crud.update_user_balance(db, current_user["id"], -cost)
-    return {"message": "Currency deducted", "new_balance": updated_user.balance}
+    Pass the returned ``next_before`` as ``before`` to fetch the next page.
+    """
+    transactions = await async_crud.get_transactions(
+        db, current_user["id"], limit, before
+    )
+    next_before = transactions[-1]["id"] if len(transactions) == limit else None
+    return {"transactions": transactions, "next_before": next_before}
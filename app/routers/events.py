@@ -0,0 +1,180 @@
+import asyncio
+import json
+import math
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core import events
+from app.core.auth import claims_revoked, get_current_user, token_claims
+from app.db import async_crud
+from app.db.database import get_db
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+# Seconds of silence after which an SSE comment is sent to keep proxies happy
+KEEPALIVE_SECONDS = 15
+
+
+def _token(headers, token: Optional[str]) -> Optional[str]:
+    """Browsers cannot set headers on EventSource or WebSocket, so the token
+    may also come as a query parameter."""
+    scheme, _, credentials = headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        return credentials
+    return token
+
+
+class _Grant:
+    """What a stream's token allows: that user's events until the token
+    expires or is revoked, whichever comes first."""
+
+    def __init__(self, user_id: int, claims: dict):
+        self.user_id = user_id
+        self.claims = claims
+
+    def seconds_left(self) -> float:
+        expires_at = self.claims.get("exp")
+        return math.inf if expires_at is None else expires_at - time.time()
+
+    def ended(self, event: Optional[dict] = None) -> bool:
+        """Whether the token has expired or been revoked, possibly by ``event``."""
+        if self.seconds_left() <= 0 or claims_revoked(self.claims):
+            return True
+        if event is None or event["type"] != "revoke":
+            return False
+        version = self.claims.get("ver")
+        return event["user_id"] == self.user_id and (
+            version is None or version < event["min_version"]
+        )
+
+    async def next_event(self, subscription, timeout: float) -> Optional[dict]:
+        """The next event, or None after ``timeout`` or when the token ends."""
+        try:
+            return await asyncio.wait_for(
+                subscription.get(), max(0, min(timeout, self.seconds_left()))
+            )
+        except asyncio.TimeoutError:
+            return None
+
+
+def _grant(token: str, user_id: int) -> _Grant:
+    # get_current_user has verified the token already
+    return _Grant(user_id, token_claims(f"Bearer {token}") or {})
+
+
+def _visible_to(event: dict, user_id: int) -> bool:
+    """Pot changes and wins are public; balances go to their owner only and
+    internal events such as revocations are never streamed."""
+    if event["type"] == "balance":
+        return event["user_id"] == user_id
+    return event["type"] in ("pot", "win")
+
+
+async def _snapshot(db: AsyncSession, user_id: int) -> list:
+    """Current pot and balance, so a new stream never has to poll first."""
+    pot_amount = await async_crud.get_pot(db)
+    balance = await async_crud.get_user_balance(db, user_id)
+    # Give the connection back; the stream may stay open for hours
+    await db.close()
+    return [
+        {"type": "pot", "pot_amount": pot_amount},
+        {"type": "balance", "user_id": user_id, "balance": balance},
+    ]
+
+
+def _format_sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def _sse_stream(subscription, initial: list, grant: _Grant):
+    """Stream events until the client goes away or its token ends."""
+    try:
+        for event in initial:
+            yield _format_sse(event)
+        while True:
+            event = await grant.next_event(subscription, KEEPALIVE_SECONDS)
+            if grant.ended(event):
+                return
+            if event is None:
+                yield ": keepalive\n\n"
+            elif _visible_to(event, grant.user_id):
+                yield _format_sse(event)
+    finally:
+        subscription.close()
+
+
+@router.get("/stream")
+async def stream_events(
+    request: Request, token: Optional[str] = None, db: AsyncSession = Depends(get_db)
+):
+    """Server-Sent Events carrying pot changes, wins and the caller's balance."""
+    token = _token(request.headers, token)
+    if token is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated"
+        )
+    current_user = await get_current_user(token, db)
+    # Subscribe before reading the snapshot so no change falls in between
+    subscription = events.hub.subscribe()
+    try:
+        initial = await _snapshot(db, current_user["id"])
+    except Exception:
+        subscription.close()
+        raise
+    return StreamingResponse(
+        _sse_stream(subscription, initial, _grant(token, current_user["id"])),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def event_socket(
+    websocket: WebSocket,
+    token: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """The same events as /events/stream, as JSON WebSocket messages."""
+    token = _token(websocket.headers, token)
+    try:
+        if token is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+        current_user = await get_current_user(token, db)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    grant = _grant(token, current_user["id"])
+
+    await websocket.accept()
+    with events.hub.subscribe() as subscription:
+        for event in await _snapshot(db, grant.user_id):
+            await websocket.send_json(event)
+
+        async def forward():
+            """Send events until the token ends."""
+            while True:
+                event = await grant.next_event(subscription, math.inf)
+                if grant.ended(event):
+                    return
+                if event is not None and _visible_to(event, grant.user_id):
+                    await websocket.send_json(event)
+
+        async def listen():
+            # Messages from the client are ignored; reading notices disconnects
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+
+        forwarder = asyncio.create_task(forward())
+        listener = asyncio.create_task(listen())
+        try:
+            done, _ = await asyncio.wait(
+                {forwarder, listener}, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            forwarder.cancel()
+            listener.cancel()
+        if forwarder in done and forwarder.exception() is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, status
+from fastapi.responses import JSONResponse
+from app.core.readiness import readiness
+
+router = APIRouter(tags=["health"])
+
+
+@router.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the worker is running. Touches nothing, so it never fails slow."""
+    return {"status": "ok"}
+
+
+@router.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: startup finished and the database answers."""
+    problem = await readiness.probe()
+    if problem is not None:
+        return JSONResponse(
+            {"status": "unavailable", "detail": problem},
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+    return {"status": "ready"}
@@ -1,52 +1,95 @@
-import random
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.db import crud
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import MAX_BATCH_SIZE, RATE_LIMIT_SEND_PER_USER
+from app.core import draws, metrics
+from app.core.ratelimit import rate_limit
+from app.db import async_crud
 from app.db.database import get_db
 from app.core.auth import get_current_user
+from app.schemas.message import MessageBatch, MessageBatchResult, MessageQuote
 
 router = APIRouter(prefix="/messages", tags=["messaging"])
 
+# One bucket for both endpoints, charged per request rather than per message
+send_limit = rate_limit("send", per_user=RATE_LIMIT_SEND_PER_USER)
 
-@router.post("/send")
-def send_message(
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
-):
-    """Send a message, deduct currency, and check if the user wins the pot."""
-    user_id = current_user["id"]
+WIN_MESSAGE = "Congratulations! You won the pot!"
+LOSE_MESSAGE = "Sorry, better luck next time!"
 
-    # Get current message count and calculate cost
-    message_count = crud.increment_message_count(db, user_id)
-    if message_count is None:
-        raise HTTPException(status_code=404, detail="User not found")
 
-    message_cost = crud.calculate_message_cost(message_count)
+def _draw(pot_amount: int) -> bool:
+    """Decide whether the sender wins the pot."""
+    return draws.engine.draw(pot_amount)
 
-    # Check if the user has enough balance
-    user_balance = crud.get_user_balance(db, user_id)
-    if user_balance < message_cost:
-        raise HTTPException(status_code=400, detail="Insufficient balance")
 
-    # Deduct message cost
-    crud.update_user_balance(db, user_id, -message_cost)
+def _batch_draw(count: int):
+    """Roll for a whole batch up front and hand the results out one by one."""
+    return draws.engine.batch(count)
+
 
-    # Add message cost to the pot
-    current_pot = crud.get_pot(db)
-    updated_pot = crud.update_pot(db, current_pot + message_cost)
+@router.post("/send", dependencies=[Depends(send_limit)])
+async def send_message(
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Send a message, deduct currency, and check if the user wins the pot."""
+    try:
+        result = await async_crud.send_message(db, current_user["id"], _draw)
+    except async_crud.InsufficientBalance:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+    if result is None:
+        raise HTTPException(status_code=404, detail="User not found")
 
-    # Randomized logic to determine if the user wins
-    win_chance = random.random()  # Generate a number between 0 and 1
-    if win_chance < 0.1:  # Example: 10% chance to win
-        # User wins the pot
-        crud.update_user_balance(db, user_id, updated_pot.amount)
-        crud.update_pot(db, 0)  # Reset the pot
+    metrics.pot_draws.inc(outcome="win" if result["won"] else "loss")
+    if result["won"]:
+        metrics.pot_payout.inc(result["pot_amount"])
         return {
-            "message": "Congratulations! You won the pot!",
-            "pot_amount": updated_pot.amount,
+            "message": WIN_MESSAGE,
+            "pot_amount": result["pot_amount"],
         }
 
     return {
-        "message": "Sorry, better luck next time!",
-        "pot_amount": updated_pot.amount,
+        "message": LOSE_MESSAGE,
+        "pot_amount": result["pot_amount"],
     }
+
+
+@router.post(
+    "/send-batch",
+    response_model=MessageBatchResult,
+    dependencies=[Depends(send_limit)],
+)
+async def send_message_batch(
+    batch: MessageBatch,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Send several messages at once, stopping at the first unaffordable one."""
+    try:
+        result = await async_crud.send_message_batch(
+            db, current_user["id"], batch.count, _batch_draw(batch.count)
+        )
+    except async_crud.InsufficientBalance:
+        raise HTTPException(status_code=400, detail="Insufficient balance")
+    if result is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    for outcome in result["results"]:
+        outcome["message"] = WIN_MESSAGE if outcome["won"] else LOSE_MESSAGE
+        metrics.pot_draws.inc(outcome="win" if outcome["won"] else "loss")
+        if outcome["won"]:
+            metrics.pot_payout.inc(outcome["pot_amount"])
+    return result
+
+
+@router.get("/quote", response_model=MessageQuote)
+async def quote_messages(
+    count: int = Query(1, gt=0, le=MAX_BATCH_SIZE),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Price the next ``count`` messages and how many the balance covers."""
+    quote = await async_crud.get_message_quote(db, current_user["id"], count)
+    if quote is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return quote
@@ -1,40 +1,65 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.db import crud
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import POT_CACHE_TTL, RATE_LIMIT_CONTRIBUTE_PER_USER
+from app.core.ratelimit import rate_limit
+from app.db import async_crud
 from app.db.database import get_db
 from app.core.auth import get_current_user
 
 router = APIRouter(prefix="/pot", tags=["pot"])
 
 
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
 @router.get("/")
-def get_pot(db: Session = Depends(get_db)):
-    """Retrieve the current pot amount."""
-    amount = crud.get_pot(db)
+async def get_pot(
+    request: Request, response: Response, db: AsyncSession = Depends(get_db)
+):
+    """Retrieve the current pot amount.
+
+    The response is tagged with the amount, so pollers sending If-None-Match
+    get an empty 304 until the pot changes.
+    """
+    amount = await async_crud.get_pot(db)
+    headers = {
+        "ETag": f'"pot-{amount}"',
+        "Cache-Control": f"public, max-age={int(POT_CACHE_TTL)}",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return {"pot_amount": amount}
 
 
-@router.post("/contribute")
-def contribute_to_pot(
+@router.post(
+    "/contribute",
+    dependencies=[
+        Depends(rate_limit("contribute", per_user=RATE_LIMIT_CONTRIBUTE_PER_USER))
+    ],
+)
+async def contribute_to_pot(
     contribution: int,
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Add a user's contribution to the pot."""
     if contribution <= 0:
         raise HTTPException(
             status_code=400, detail="Contribution must be greater than zero"
         )
-    current_pot = crud.get_pot(db)
-    updated_pot = crud.update_pot(db, current_pot + contribution)
-    return {"message": "Contribution added", "new_pot_amount": updated_pot.amount}
+    new_amount = await async_crud.add_to_pot(db, contribution, current_user["id"])
+    return {"message": "Contribution added", "new_pot_amount": new_amount}
 
 
 @router.post("/reset")
-def reset_pot(
+async def reset_pot(
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Reset the pot to 0 (e.g., after a user wins)."""
-    updated_pot = crud.update_pot(db, 0)
-    return {"message": "Pot reset", "new_pot_amount": updated_pot.amount}
+    new_amount = await async_crud.update_pot(db, 0)
+    return {"message": "Pot reset", "new_pot_amount": new_amount}
@@ -1,52 +1,103 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from typing import Literal
 
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import LEADERBOARD_SIZE, RATE_LIMIT_LOGIN_PER_IP
+from app.config import RATE_LIMIT_REGISTER_PER_IP
 from app.core.auth import get_current_user
-from app.core.auth import hash_password, verify_password, create_access_token
-from app.db import crud
+from app.core.auth import create_user_token
+from app.core.hashing import hash_password_async, verify_and_update_async
+from app.core.leaderboard import leaderboard
+from app.core.ratelimit import rate_limit
+from app.db import async_crud
 from app.db.database import get_db
 from app.schemas import user as user_schemas
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
-@router.post("/register", response_model=user_schemas.Token)
-def register(user: user_schemas.UserCreate, db: Session = Depends(get_db)):
-    if crud.get_user_by_username(db, user.username):
+@router.post(
+    "/register",
+    response_model=user_schemas.Token,
+    dependencies=[Depends(rate_limit("register", per_ip=RATE_LIMIT_REGISTER_PER_IP))],
+)
+async def register(user: user_schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    hashed_password = await hash_password_async(user.password)
+    new_user = await async_crud.create_user(db, user, hashed_password)
+    if new_user is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Username already exists"
         )
-
-    hashed_password = hash_password(user.password)
-    new_user = crud.create_user(db, user, hashed_password)
-    access_token = create_access_token(data={"sub": new_user.username})
+    access_token = create_user_token(new_user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-@router.post("/login", response_model=user_schemas.Token)
-def login(user: user_schemas.UserLogin, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, user.username)
-    if not db_user or not verify_password(user.password, db_user.hashed_password):
+@router.post(
+    "/login",
+    response_model=user_schemas.Token,
+    dependencies=[Depends(rate_limit("login", per_ip=RATE_LIMIT_LOGIN_PER_IP))],
+)
+async def login(user: user_schemas.UserLogin, db: AsyncSession = Depends(get_db)):
+    db_user = await async_crud.get_user_by_username(db, user.username)
+    verified, new_hash = False, None
+    if db_user:
+        verified, new_hash = await verify_and_update_async(
+            user.password, db_user.hashed_password
+        )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
         )
 
-    access_token = create_access_token(data={"sub": db_user.username})
+    access_token = create_user_token(db_user)
+    if new_hash:
+        await async_crud.update_user_password_hash(db, db_user.id, new_hash)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @router.get("/me")
-def get_user_profile(
+async def get_user_profile(
     current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Fetch the profile of the logged-in user."""
-    user = crud.get_user_by_username(db, current_user["username"])
+    user = await async_crud.get_user(db, current_user["id"])
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    balance, message_count = await async_crud.get_user_totals(db, user.id)
     return {
         "id": user.id,
         "username": user.username,
-        "balance": user.balance,
-        "message_count": user.message_count,
+        "balance": balance,
+        "message_count": message_count,
+    }
+
+
+@router.post("/logout")
+async def logout(
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Revoke every token issued to the logged-in user."""
+    version = await async_crud.revoke_user_tokens(db, current_user["id"])
+    if version is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": "Logged out"}
+
+
+@router.get("/leaderboard", response_model=user_schemas.Leaderboard)
+async def get_leaderboard(
+    by: Literal["balance", "messages", "wins"] = "balance",
+    limit: int = Query(10, gt=0, le=LEADERBOARD_SIZE),
+    db: AsyncSession = Depends(get_db),
+):
+    """Rank users by balance, messages sent or pots won, from memory."""
+    entries = await leaderboard.top(db, by, limit)
+    return {
+        "by": by,
+        "entries": [
+            {"rank": rank, "username": username, "value": value}
+            for rank, (_, username, value) in enumerate(entries, 1)
+        ],
     }
@@ -0,0 +1,17 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class TransactionOut(BaseModel):
+    id: int
+    delta: int
+    reason: str
+    pot_id: Optional[int] = None
+    created_at: datetime
+
+
+class TransactionPage(BaseModel):
+    transactions: List[TransactionOut]
+    next_before: Optional[int] = None
@@ -0,0 +1,35 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from app.config import MAX_BATCH_SIZE
+
+
+class MessageBatch(BaseModel):
+    count: int = Field(gt=0, le=MAX_BATCH_SIZE)
+
+
+class MessageOutcome(BaseModel):
+    message: str
+    message_count: int
+    cost: int
+    won: bool
+    pot_amount: int
+
+
+class MessageBatchResult(BaseModel):
+    sent: int
+    total_cost: int
+    balance: int
+    pot_amount: int
+    results: List[MessageOutcome]
+
+
+class MessageQuote(BaseModel):
+    message_count: int
+    count: int
+    next_cost: int
+    total_cost: int
+    balance: int
+    # How many of the next ``count`` messages the balance covers, before wins
+    affordable: int
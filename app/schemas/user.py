@@ -1,4 +1,8 @@
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+from app.config import MAX_BULK_USERS
 
 
 class UserCreate(BaseModel):
@@ -18,3 +22,37 @@ class Token(BaseModel):
 
 class UserBalance(BaseModel):
     balance: int
+
+
+class BulkUser(BaseModel):
+    """A user to import, with either a password or an existing bcrypt hash."""
+
+    username: str
+    password: Optional[str] = None
+    hashed_password: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_one_secret(self):
+        if (self.password is None) == (self.hashed_password is None):
+            raise ValueError("Give exactly one of password or hashed_password")
+        return self
+
+
+class BulkUserCreate(BaseModel):
+    users: List[BulkUser] = Field(min_length=1, max_length=MAX_BULK_USERS)
+
+
+class BulkUserResult(BaseModel):
+    created: int
+    skipped: int
+
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    username: str
+    value: int
+
+
+class Leaderboard(BaseModel):
+    by: Literal["balance", "messages", "wins"]
+    entries: List[LeaderboardEntry]
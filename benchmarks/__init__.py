@@ -0,0 +1,4 @@
+"""Load-test and benchmark harness for the API.
+
+Run ``python -m benchmarks --help`` for usage.
+"""
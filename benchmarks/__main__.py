@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+from benchmarks.harness import WORKLOADS
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Drive API workloads and report throughput and latency as JSON.",
+    )
+    parser.add_argument(
+        "--database-url",
+        default="sqlite:///./bench.db",
+        help="Sync SQLAlchemy URL of the database to benchmark against.",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["inprocess", "uvicorn"],
+        default="inprocess",
+        help="Call the app in-process over ASGI or start it under uvicorn.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="uvicorn workers (uvicorn mode)."
+    )
+    parser.add_argument("--port", type=int, default=8765, help="uvicorn port.")
+    parser.add_argument(
+        "--workload",
+        action="append",
+        choices=sorted(WORKLOADS),
+        help="Workload to run; repeat for several. Defaults to all of them.",
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--requests", type=int, default=500, help="Requests per workload."
+    )
+    parser.add_argument(
+        "--users", type=int, default=50, help="Seeded users shared by the workloads."
+    )
+    parser.add_argument(
+        "--bcrypt-rounds",
+        type=int,
+        help="Override BCRYPT_ROUNDS for the app under test.",
+    )
+    parser.add_argument("--output", help="Write the JSON report here as well.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The app reads its configuration at import time, so set it up first
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    if args.bcrypt_rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+    from benchmarks.harness import run
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Workload driver and reporting for ``python -m benchmarks``.
+
+Nothing from ``app`` is imported at module level: the CLI has to point the
+app at the benchmark database before its configuration is read.
+"""
+
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import httpx
+
+PASSWORD = "benchmark-password"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Fits users.balance, a Postgres INTEGER, with room for pot wins on top
+SEED_BALANCE = 10**9
+
+
+class Context:
+    """Seeded users and tokens shared by the workloads of one run."""
+
+    def __init__(self, prefix: str, usernames: list, tokens: list):
+        self.prefix = prefix
+        self.usernames = usernames
+        self.tokens = tokens
+
+    def auth(self, i: int) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[i % len(self.tokens)]}"}
+
+
+def _register(ctx: Context, i: int):
+    username = f"{ctx.prefix}-new-{i}"
+    return (
+        "POST",
+        "/users/register",
+        {"json": {"username": username, "password": PASSWORD}},
+    )
+
+
+def _login(ctx: Context, i: int):
+    username = ctx.usernames[i % len(ctx.usernames)]
+    return (
+        "POST",
+        "/users/login",
+        {"json": {"username": username, "password": PASSWORD}},
+    )
+
+
+def _balance(ctx: Context, i: int):
+    return "GET", "/currency/balance", {"headers": ctx.auth(i)}
+
+
+def _pot(ctx: Context, i: int):
+    return "GET", "/pot/", {}
+
+
+def _send(ctx: Context, i: int):
+    return "POST", "/messages/send", {"headers": ctx.auth(i)}
+
+
+# name -> function building the (method, url, request kwargs) of request i
+WORKLOADS = {
+    "register": _register,
+    "login": _login,
+    "balance": _balance,
+    "pot": _pot,
+    "send": _send,
+}
+
+
+def migrate(database_url: str):
+    """Bring the database to the migration head, as a release does."""
+    from sqlalchemy.engine import make_url
+
+    if make_url(database_url).get_backend_name() == "sqlite":
+        # The migrations are written for Postgres; a throwaway SQLite file
+        # gets the models' schema instead
+        from sqlalchemy import create_engine
+
+        from app.db.database import Base
+
+        engine = create_engine(database_url)
+        Base.metadata.create_all(bind=engine)
+        engine.dispose()
+        return
+    subprocess.run(
+        [sys.executable, "-m", "alembic", "upgrade", "head"],
+        cwd=ROOT,
+        env={**os.environ, "DATABASE_URL": database_url},
+        check=True,
+        capture_output=True,
+    )
+
+
+def seed(database_url: str, users: int) -> Context:
+    """Migrate the database and insert users who can afford any workload."""
+    from sqlalchemy import create_engine, insert, select
+
+    from app.core.auth import create_user_token
+    from app.core.hashing import hash_password
+    from app.db import models
+
+    migrate(database_url)
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    hashed_password = hash_password(PASSWORD)
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(models.User),
+            [
+                {
+                    "username": f"{prefix}-{i}",
+                    "hashed_password": hashed_password,
+                    "balance": SEED_BALANCE,
+                    "message_count": 0,
+                    "token_version": 0,
+                }
+                for i in range(users)
+            ],
+        )
+        rows = conn.execute(
+            select(models.User.id, models.User.username, models.User.token_version)
+            .where(models.User.username.like(f"{prefix}-%"))
+            .order_by(models.User.id)
+        ).all()
+    engine.dispose()
+    return Context(
+        prefix, [row.username for row in rows], [create_user_token(row) for row in rows]
+    )
+
+
+def _summarize(latencies: list, errors: int, elapsed: float, statements) -> dict:
+    # Inclusive cuts stay within the samples, so p99 never exceeds max
+    cuts = (
+        statistics.quantiles(latencies, n=100, method="inclusive")
+        if len(latencies) > 1
+        else latencies * 99
+    )
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 3),
+            "p50": round(cuts[49] * 1000, 3),
+            "p95": round(cuts[94] * 1000, 3),
+            "p99": round(cuts[98] * 1000, 3),
+            "max": round(max(latencies) * 1000, 3),
+        },
+        "sql_statements_per_request": None,
+    }
+    if statements is not None and latencies:
+        summary["sql_statements_per_request"] = round(statements / len(latencies), 2)
+    return summary
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    workload: str,
+    ctx: Context,
+    requests: int,
+    concurrency: int,
+    statement_counter=None,
+) -> dict:
+    """Issue ``requests`` requests of one workload from ``concurrency`` workers."""
+    build = WORKLOADS[workload]
+    indices = iter(range(requests))
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for i in indices:
+            method, url, kwargs = build(ctx, i)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    statements_before = statement_counter() if statement_counter else None
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    statements = statement_counter() - statements_before if statement_counter else None
+    return _summarize(latencies, errors, elapsed, statements)
+
+
+@asynccontextmanager
+async def inprocess_client():
+    """Serve the app over ASGI in this process, counting its SQL statements."""
+    from sqlalchemy import event
+
+    from app.db.database import get_async_engine
+    from main import app
+
+    statements = 0
+
+    def count(*args):
+        nonlocal statements
+        statements += 1
+
+    sync_engine = get_async_engine().sync_engine
+    event.listen(sync_engine, "before_cursor_execute", count)
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://benchmark", timeout=60
+            ) as client:
+                yield client, lambda: statements
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count)
+
+
+@asynccontextmanager
+async def uvicorn_client(port: int, workers: int):
+    """Start the app under uvicorn in a subprocess and wait until it answers."""
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env=os.environ.copy(),
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    if (await client.get("/pot/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError("uvicorn did not start")
+                await asyncio.sleep(0.2)
+            yield client, None
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+async def run(args) -> dict:
+    ctx = seed(args.database_url, args.users)
+    workloads = args.workload or list(WORKLOADS)
+    if args.mode == "uvicorn":
+        client_context = uvicorn_client(args.port, args.workers)
+    else:
+        client_context = inprocess_client()
+
+    results = {}
+    async with client_context as (client, statement_counter):
+        for workload in workloads:
+            results[workload] = await drive(
+                client,
+                workload,
+                ctx,
+                args.requests,
+                args.concurrency,
+                statement_counter,
+            )
+
+    config = {key: value for key, value in vars(args).items() if key != "output"}
+    config["workload"] = workloads
+    return {"config": config, "results": results}
@@ -0,0 +1,107 @@
+"""Import-time budget for worker cold starts.
+
+A scaled-to-zero deployment pays for importing the app on every cold start.
+This imports it in fresh interpreters under ``python -X importtime``, keeps
+the fastest run, and fails if that run went over the budget or loaded a
+module that must only load on first use (database drivers, passlib, PyJWT,
+alembic, the hashing process pool).
+
+    python -m benchmarks.importtime --budget-ms 500
+
+Exits with status 1 on a regression.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import Counter
+
+DEFAULT_BUDGET_MS = 500
+# Loaded by the first query, login, migration check or hash, never by an import
+LAZY_MODULES = (
+    "asyncpg",
+    "psycopg2",
+    "aiosqlite",
+    "passlib",
+    "bcrypt",
+    "jwt",
+    "alembic",
+    "concurrent.futures.process",
+)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module: str = "main") -> dict:
+    """Import ``module`` in a new interpreter and parse what it cost.
+
+    Returns the cumulative milliseconds of the import, the self time per
+    top-level package and the names of every module it loaded.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+        check=True,
+    )
+    total_us, packages, loaded = None, Counter(), set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        loaded.add(name)
+        packages[name.split(".")[0]] += int(self_us)
+        if name == module:
+            total_us = int(cumulative_us)
+    return {"ms": total_us / 1000, "packages": packages, "modules": loaded}
+
+
+def lazy_modules_loaded(modules: set) -> list:
+    return sorted(
+        name
+        for name in modules
+        if any(name == lazy or name.startswith(lazy + ".") for lazy in LAZY_MODULES)
+    )
+
+
+def check(module: str, budget_ms: float, runs: int = 5, top: int = 10) -> list:
+    """Print the fastest of ``runs`` imports and return what went wrong."""
+    fastest = min((measure(module) for _ in range(runs)), key=lambda m: m["ms"])
+    sys.stdout.write(
+        f"import {module}: {fastest['ms']:.1f} ms (budget {budget_ms:g} ms)\n"
+    )
+    for package, self_us in fastest["packages"].most_common(top):
+        sys.stdout.write(f"  {self_us / 1000:8.1f} ms  {package}\n")
+
+    problems = []
+    if fastest["ms"] > budget_ms:
+        problems.append(
+            f"took {fastest['ms']:.1f} ms, over the {budget_ms:g} ms budget"
+        )
+    eager = lazy_modules_loaded(fastest["modules"])
+    if eager:
+        problems.append(f"loaded modules that must load lazily: {', '.join(eager)}")
+    for problem in problems:
+        sys.stdout.write(f"FAIL {problem}\n")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.importtime",
+        description="Check the app's import time against a budget.",
+    )
+    parser.add_argument("--module", default="main", help="Module to import.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Imports to run; the fastest counts."
+    )
+    parser.add_argument("--top", type=int, default=10, help="Slowest packages to list.")
+    args = parser.parse_args(argv)
+    sys.exit(1 if check(args.module, args.budget_ms, args.runs, args.top) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,68 @@
+from contextlib import asynccontextmanager
+from typing import Optional
+
 from fastapi import FastAPI
-from app.routers import user, currency, pot, messaging
-from app.db.database import Base, engine
+from app.config import DRAW_AUDIT_LOG, Settings
+from app.core import background, draws, events, hashing, idempotency, metrics
+from app.core import profiler
+from app.core import ratelimit, readiness
+from app.routers import admin, health, user, currency, pot, messaging
+from app.routers import events as events_router
+from app.routers import metrics as metrics_router
+from app.db import database
+
+
+# The schema is managed by `alembic upgrade head`; startup touches no database
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    draws.configure_audit_log(DRAW_AUDIT_LOG)
+    tasks = [readiness.start(), *background.start()]
+    yield
+    await background.stop(tasks)
+    await events.hub.stop()
+    hashing.shutdown()
+    draws.engine.reveal()
+
+
+def _instrument(engine):
+    metrics.instrument_engine(engine.sync_engine, database.pool_checkout_stats)
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Build the application without connecting to anything.
+
+    The engines are created when first used, so neither this nor importing
+    the modules it wires together does any I/O.
+
+    There is one application per process. The engines are module state, like
+    the event hub, the caches and the leaderboard, so every app built here
+    shares them. Settings may point them at another database only until the
+    first query; after that a different database raises RuntimeError.
+    """
+    settings = settings or Settings()
+    database.configure(settings.database_url, settings.async_database_url)
+
+    app = FastAPI(lifespan=lifespan)
+    # Innermost, under the global limit; it charges the route's own limits
+    # itself before claiming a key
+    app.add_middleware(idempotency.IdempotencyMiddleware)
+    app.add_middleware(profiler.ProfilerMiddleware)
+    app.add_middleware(ratelimit.RateLimitMiddleware)
 
-# Initialize database
-Base.metadata.create_all(bind=engine)
+    if settings.metrics_enabled:
+        database.on_async_engine(_instrument)
+        app.add_middleware(metrics.MetricsMiddleware)
+        app.include_router(metrics_router.router)
 
-app = FastAPI()
+    # Include routers
+    app.include_router(health.router)
+    app.include_router(admin.router)
+    app.include_router(user.router)
+    app.include_router(currency.router)
+    app.include_router(pot.router)
+    app.include_router(messaging.router)
+    app.include_router(events_router.router)
+    return app
 
-# Include routers
-app.include_router(user.router)
-app.include_router(currency.router)
-app.include_router(pot.router)
-app.include_router(messaging.router)
 
+app = create_app()
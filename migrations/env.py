@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -21,6 +22,12 @@ if config.config_file_name is not None:
 from app.db.models import Base
 target_metadata = Base.metadata
 
+# Migrate the database the app is configured for, not the one in alembic.ini
+if os.getenv("DATABASE_URL"):
+    config.set_main_option(
+        "sqlalchemy.url", os.environ["DATABASE_URL"].replace("%", "%%")
+    )
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -0,0 +1,29 @@
+"""Add user token version
+
+Revision ID: 3f1c2a9d7b10
+Revises: 49689718ff7f
+Create Date: 2026-10-18 09:12:44.210387
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9d7b10'
+down_revision: Union[str, None] = '49689718ff7f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'users',
+        sa.Column('token_version', sa.Integer(), nullable=True, server_default='0'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'token_version')
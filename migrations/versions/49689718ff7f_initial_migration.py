@@ -1,7 +1,7 @@
 """Initial migration
 
 Revision ID: 49689718ff7f
-Revises: 
+Revises: 0b3e5a7c9d12
 Create Date: 2024-12-12 21:41:05.555624
 
 """
@@ -13,7 +13,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision: str = '49689718ff7f'
-down_revision: Union[str, None] = None
+down_revision: Union[str, None] = '0b3e5a7c9d12'
 branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
@@ -0,0 +1,47 @@
+"""Add transactions ledger
+
+Revision ID: 8a4e6c2f1d35
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-18 10:03:12.874512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4e6c2f1d35'
+down_revision: Union[str, None] = '3f1c2a9d7b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'transactions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('delta', sa.Integer(), nullable=False),
+        sa.Column('reason', sa.String(), nullable=False),
+        sa.Column('pot_id', sa.Integer(), nullable=True),
+        sa.Column(
+            'created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False
+        ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(
+        'ix_transactions_user_id_id', 'transactions', ['user_id', 'id'], unique=False
+    )
+    op.add_column(
+        'users',
+        sa.Column('ledger_cursor', sa.Integer(), nullable=True, server_default='0'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'ledger_cursor')
+    op.drop_index('ix_transactions_user_id_id', table_name='transactions')
+    op.drop_table('transactions')
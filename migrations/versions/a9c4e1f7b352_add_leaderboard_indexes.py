@@ -0,0 +1,47 @@
+"""Add pot wins and leaderboard indexes
+
+Revision ID: a9c4e1f7b352
+Revises: f2a6d1c8e930
+Create Date: 2026-10-18 17:48:12.502913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c4e1f7b352'
+down_revision: Union[str, None] = 'f2a6d1c8e930'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# "pot_win" rows already folded into the snapshot by compaction; later ones
+# are counted on top of users.pot_wins
+FOLDED_WINS = """
+    SELECT count(*) FROM transactions
+    WHERE transactions.user_id = users.id
+      AND transactions.id <= coalesce(users.ledger_cursor, 0)
+      AND transactions.reason = 'pot_win'
+"""
+
+
+def upgrade() -> None:
+    op.add_column(
+        'users',
+        sa.Column('pot_wins', sa.Integer(), nullable=True, server_default='0'),
+    )
+    op.execute(f'UPDATE users SET pot_wins = ({FOLDED_WINS})')
+    op.create_index(op.f('ix_users_balance'), 'users', ['balance'], unique=False)
+    op.create_index(
+        op.f('ix_users_message_count'), 'users', ['message_count'], unique=False
+    )
+    op.create_index(op.f('ix_users_pot_wins'), 'users', ['pot_wins'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_users_pot_wins'), table_name='users')
+    op.drop_index(op.f('ix_users_message_count'), table_name='users')
+    op.drop_index(op.f('ix_users_balance'), table_name='users')
+    op.drop_column('users', 'pot_wins')
@@ -0,0 +1,34 @@
+"""Seed pot shards
+
+Revision ID: b6e2d9f4a187
+Revises: d4b8f2a6c913
+Create Date: 2026-10-19 09:12:44.381205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from app.config import POT_SHARDS
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6e2d9f4a187'
+down_revision: Union[str, None] = 'd4b8f2a6c913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Shards that already exist keep their amount; a drain then always finds
+    # every shard to lock instead of racing one created by a contribution
+    for shard_id in range(1, POT_SHARDS + 1):
+        op.execute(
+            f'INSERT INTO pot (id, amount) SELECT {shard_id}, 0 '
+            f'WHERE NOT EXISTS (SELECT 1 FROM pot WHERE id = {shard_id})'
+        )
+
+
+def downgrade() -> None:
+    # Empty shards are harmless to the previous revision
+    pass
@@ -0,0 +1,38 @@
+"""Derive message counts from the ledger
+
+Revision ID: c5d2e8a41f67
+Revises: 8a4e6c2f1d35
+Create Date: 2026-10-18 14:21:45.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d2e8a41f67'
+down_revision: Union[str, None] = '8a4e6c2f1d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# "message" rows not yet folded by compaction; their sends used to bump
+# users.message_count directly, and now count on top of it
+PENDING_MESSAGES = """
+    SELECT count(*) FROM transactions
+    WHERE transactions.user_id = users.id
+      AND transactions.id > coalesce(users.ledger_cursor, 0)
+      AND transactions.reason = 'message'
+"""
+
+
+def upgrade() -> None:
+    op.execute(
+        f'UPDATE users SET message_count = message_count - ({PENDING_MESSAGES})'
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        f'UPDATE users SET message_count = message_count + ({PENDING_MESSAGES})'
+    )
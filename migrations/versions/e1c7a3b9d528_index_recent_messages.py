@@ -0,0 +1,33 @@
+"""Index recent messages
+
+Revision ID: e1c7a3b9d528
+Revises: b6e2d9f4a187
+Create Date: 2026-10-19 11:40:27.915034
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1c7a3b9d528'
+down_revision: Union[str, None] = 'b6e2d9f4a187'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Windowed pricing counts a user's sends since a cutoff on every send
+    op.create_index(
+        'ix_transactions_user_id_created_at',
+        'transactions',
+        ['user_id', 'created_at'],
+        unique=False,
+        postgresql_where=sa.text("reason = 'message'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_transactions_user_id_created_at', table_name='transactions')
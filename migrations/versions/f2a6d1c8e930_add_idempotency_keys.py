@@ -0,0 +1,44 @@
+"""Add idempotency keys
+
+Revision ID: f2a6d1c8e930
+Revises: e7b3f9c2a854
+Create Date: 2026-10-18 16:21:05.118342
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a6d1c8e930'
+down_revision: Union[str, None] = 'e7b3f9c2a854'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('fingerprint', sa.String(), nullable=False),
+        sa.Column('status_code', sa.Integer(), nullable=True),
+        sa.Column('body', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'key'),
+    )
+    op.create_index(
+        op.f('ix_idempotency_keys_created_at'),
+        'idempotency_keys',
+        ['created_at'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f('ix_idempotency_keys_created_at'), table_name='idempotency_keys'
+    )
+    op.drop_table('idempotency_keys')
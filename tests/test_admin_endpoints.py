@@ -0,0 +1,150 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from main import app
+from app.db.database import Base, get_db
+from app.core import auth, profiler
+from app.core.auth import hash_password
+from app.db.models import User, Pot
+
+# Test database setup
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
+
+ADMIN_TOKEN = "test-admin-token"
+
+
+# Override the get_db dependency for testing
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+# Test client
+client = TestClient(app)
+
+
+# Setup test database
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    # Other test modules replace the override when they are imported
+    app.dependency_overrides[get_db] = override_get_db
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    hashed_password = hash_password("testpassword")
+    db.add(User(username="testuser", hashed_password=hashed_password, balance=100))
+    db.add(Pot(amount=0))
+    db.commit()
+    db.close()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_TOKEN", ADMIN_TOKEN)
+
+
+@pytest.fixture
+def profiling(admin, monkeypatch):
+    monkeypatch.setattr(profiler, "ADMIN_TOKEN", ADMIN_TOKEN)
+    monkeypatch.setattr(profiler, "PROFILING_ENABLED", True)
+
+
+# Tests
+def test_admin_endpoints_are_hidden_without_admin_token():
+    response = client.get("/admin/profile", headers={"X-Admin-Token": ""})
+    assert response.status_code == 404
+
+
+def test_admin_endpoints_reject_wrong_token(profiling):
+    response = client.get("/admin/profile", headers={"X-Admin-Token": "wrong"})
+    assert response.status_code == 403
+
+
+def test_profile_worker_returns_collapsed_stacks(profiling):
+    response = client.get(
+        "/admin/profile",
+        params={"seconds": 0.2, "interval_ms": 1},
+        headers={"X-Admin-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack and int(count) > 0
+
+
+def test_profile_single_request(profiling):
+    response = client.post(
+        "/users/login",
+        json={"username": "testuser", "password": "testpassword"},
+        headers={"X-Profile": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    response = client.get(
+        f"/admin/profile/requests/{profile_id}",
+        headers={"X-Admin-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200
+    # Waiting on the password hash shows up as suspended samples
+    assert profiler.SUSPENDED in response.text
+
+
+def test_bulk_register_skips_taken_usernames(admin):
+    existing_hash = hash_password("imported")
+    response = client.post(
+        "/admin/users/bulk",
+        json={
+            "users": [
+                {"username": "testuser", "password": "other"},
+                {"username": "load-1", "password": "loadtest"},
+                {"username": "load-2", "password": "loadtest"},
+                {"username": "load-2", "password": "loadtest"},
+                {"username": "imported", "hashed_password": existing_hash},
+            ]
+        },
+        headers={"X-Admin-Token": ADMIN_TOKEN},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"created": 3, "skipped": 2}
+
+    for username, password in [("load-2", "loadtest"), ("imported", "imported")]:
+        response = client.post(
+            "/users/login", json={"username": username, "password": password}
+        )
+        assert response.status_code == 200
+
+
+def test_bulk_register_validates_secrets(admin):
+    headers = {"X-Admin-Token": ADMIN_TOKEN}
+    response = client.post(
+        "/admin/users/bulk",
+        json={"users": [{"username": "x", "hashed_password": "plaintext"}]},
+        headers=headers,
+    )
+    assert response.status_code == 400
+    response = client.post(
+        "/admin/users/bulk", json={"users": [{"username": "x"}]}, headers=headers
+    )
+    assert response.status_code == 422
+
+
+def test_profile_header_needs_admin_token(profiling):
+    response = client.get("/pot/", headers={"X-Profile": "wrong"})
+    assert response.status_code == 200
+    assert "X-Profile-Id" not in response.headers
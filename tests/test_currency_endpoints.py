@@ -1,27 +1,33 @@
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from main import app
 from app.db.database import Base, get_db
 from app.core.auth import hash_password
+from app.db import crud
 from app.db.models import User
 
 # Test database setup
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
 
 
 # Override the get_db dependency for testing
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
@@ -92,3 +98,51 @@ def test_get_balance_after_deduction():
     )
     assert response.status_code == 200
     assert response.json()["balance"] == 90
+
+
+def test_history_lists_balance_changes_newest_first():
+    token = authenticate_user()
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/currency/deduct", params={"cost": 5}, headers=headers)
+    client.post("/currency/deduct", params={"cost": -20}, headers=headers)
+
+    response = client.get("/currency/history", params={"limit": 2}, headers=headers)
+    assert response.status_code == 200
+    page = response.json()
+    assert [t["delta"] for t in page["transactions"]] == [20, -5]
+    assert page["next_before"] == page["transactions"][-1]["id"]
+
+    response = client.get(
+        "/currency/history",
+        params={"limit": 2, "before": page["next_before"]},
+        headers=headers,
+    )
+    page = response.json()
+    assert [t["delta"] for t in page["transactions"]] == [-10]
+    assert page["transactions"][0]["reason"] == "adjustment"
+    assert page["next_before"] is None
+
+
+def test_compaction_folds_ledger_into_balance():
+    token = authenticate_user()
+    headers = {"Authorization": f"Bearer {token}"}
+    balance = client.get("/currency/balance", headers=headers).json()["balance"]
+
+    db = TestingSessionLocal()
+    assert crud.compact_ledger(db) == 1
+    user = db.query(User).filter(User.username == "testuser").one()
+    assert user.balance == balance
+    assert crud.compact_ledger(db) == 0
+    db.close()
+
+    assert client.get("/currency/balance", headers=headers).json()["balance"] == balance
+
+
+def test_database_rejects_negative_balances():
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.username == "testuser").one()
+    user.balance = -1
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+    db.close()
@@ -0,0 +1,87 @@
+import hashlib
+import logging
+
+from app.core import draws
+
+
+def test_seeded_engines_repeat_their_rolls():
+    first = draws.DrawEngine(seed=b"seed", block_size=8)
+    second = draws.DrawEngine(seed=b"seed", block_size=8)
+    other = draws.DrawEngine(seed=b"other", block_size=8)
+    outcomes = [first.draw(0) for _ in range(20)]
+    assert outcomes == [second.draw(0) for _ in range(20)]
+    assert first._take(20) != other._take(20)
+
+
+def test_batch_takes_the_same_rolls_as_single_draws():
+    single = draws.DrawEngine(seed=b"seed", block_size=8)
+    batched = draws.DrawEngine(seed=b"seed", block_size=8)
+    draw = batched.batch(20)
+    assert [single.draw(0) for _ in range(20)] == [draw(0) for _ in range(20)]
+
+
+def test_win_rate_follows_the_probability():
+    engine = draws.DrawEngine(seed=b"seed", probability=lambda pot: pot / 100)
+    assert not any(engine.draw(0) for _ in range(1000))
+    assert all(engine.draw(100) for _ in range(1000))
+    wins = sum(engine.draw(10) for _ in range(10_000))
+    assert 800 < wins < 1200
+
+
+def test_probability_rises_with_the_pot(monkeypatch):
+    monkeypatch.setattr(draws, "DRAW_WIN_PROBABILITY_PER_UNIT", 0.001)
+    monkeypatch.setattr(draws, "DRAW_MAX_WIN_PROBABILITY", 0.5)
+    assert draws.win_probability(0) == draws.DRAW_WIN_PROBABILITY
+    assert draws.win_probability(100) > draws.win_probability(0)
+    assert draws.win_probability(10**6) == 0.5
+
+
+def test_logged_draws_can_be_verified_from_the_revealed_seed(caplog):
+    engine = draws.DrawEngine(block_size=4)
+    with caplog.at_level(logging.INFO, logger=draws.__name__):
+        outcomes = [engine.draw(0) for _ in range(5)]
+
+    messages = [record.getMessage() for record in caplog.records]
+    commitment = messages[0].split()[2]
+    revealed = next(m for m in messages if "revealed" in m)
+    seed = bytes.fromhex(revealed.split()[-1])
+    assert hashlib.sha256(seed).hexdigest() == commitment
+
+    rolls = draws.block_rolls(seed, 4)
+    logged = [m for m in messages if m.startswith(f"Draw {commitment}:")]
+    assert [int(m.split()[3], 16) for m in logged] == list(rolls)
+    expected = [roll < draws.win_probability(0) * draws.ROLL_RANGE for roll in rolls]
+    assert outcomes[:4] == expected
+
+
+def test_settled_blocks_can_be_verified_from_the_audit_log(tmp_path):
+    audit_log = tmp_path / "draws.log"
+    draws.configure_audit_log(str(audit_log))
+    try:
+        engine = draws.DrawEngine(block_size=4)
+        outcomes = [engine.draw(0) for _ in range(6)]
+        # As at shutdown, with the second block half used
+        engine.reveal()
+    finally:
+        draws.configure_audit_log("")
+
+    # Each line is a timestamp followed by the message
+    messages = [line.split(" ", 2)[2] for line in audit_log.read_text().splitlines()]
+    seeds = {
+        message.split()[2]: bytes.fromhex(message.split()[-1])
+        for message in messages
+        if "revealed" in message
+    }
+    verified = []
+    for message in messages:
+        if not message.startswith("Draw ") or message.startswith("Draw block"):
+            continue
+        _, draw, _, roll, _, probability, *_, outcome = message.split()
+        commitment, index = draw.split(":")
+        seed = seeds[commitment]
+        assert hashlib.sha256(seed).hexdigest() == commitment
+        assert draws.block_rolls(seed, 4)[int(index)] == int(roll, 16)
+        won = int(roll, 16) < float(probability) * draws.ROLL_RANGE
+        assert outcome == ("won" if won else "lost")
+        verified.append(won)
+    assert verified == outcomes
@@ -0,0 +1,209 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from sqlalchemy import create_engine, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from main import app
+from app.db.database import Base, get_db
+from app.core import events
+from app.core import auth
+from app.core.auth import hash_password
+from app.db import crud
+from app.db.models import User, Pot
+from app.routers.events import _Grant, _sse_stream
+
+# Test database setup
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
+
+
+# Override the get_db dependency for testing
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+# Setup test database
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    # Other test modules replace the override when they are imported
+    app.dependency_overrides[get_db] = override_get_db
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    hashed_password = hash_password("testpassword")
+    db.add(User(username="alice", hashed_password=hashed_password, balance=100))
+    db.add(User(username="bob", hashed_password=hashed_password, balance=100))
+    db.add(Pot(amount=0))
+    db.commit()
+    db.close()
+    # Other modules may have left their pot amount in the cache
+    crud.pot_cache.invalidate()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+# Streams and the requests that trigger events share the lifespan's event loop
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+def authenticate_user(client, username):
+    response = client.post(
+        "/users/login", json={"username": username, "password": "testpassword"}
+    )
+    return response.json()["access_token"]
+
+
+# Tests
+def test_websocket_pushes_snapshot_then_changes(client):
+    token = authenticate_user(client, "alice")
+    headers = {"Authorization": f"Bearer {token}"}
+    with client.websocket_connect(f"/events/ws?token={token}") as websocket:
+        assert websocket.receive_json() == {"type": "pot", "pot_amount": 0}
+        assert websocket.receive_json()["balance"] == 100
+
+        client.post("/pot/contribute", params={"contribution": 5}, headers=headers)
+        assert websocket.receive_json() == {"type": "pot", "pot_amount": 5}
+
+        client.post("/currency/deduct", params={"cost": 10}, headers=headers)
+        event = websocket.receive_json()
+        assert event["type"] == "balance" and event["balance"] == 90
+
+        client.post("/pot/reset", headers=headers)
+        assert websocket.receive_json() == {"type": "pot", "pot_amount": 0}
+
+
+def test_balance_events_are_private(client):
+    alice = authenticate_user(client, "alice")
+    bob = authenticate_user(client, "bob")
+    with client.websocket_connect(f"/events/ws?token={alice}") as websocket:
+        websocket.receive_json()
+        websocket.receive_json()
+
+        client.post(
+            "/currency/deduct",
+            params={"cost": 1},
+            headers={"Authorization": f"Bearer {bob}"},
+        )
+        client.post("/pot/reset", headers={"Authorization": f"Bearer {alice}"})
+        # Bob's balance change is skipped; the next event is the pot reset
+        assert websocket.receive_json() == {"type": "pot", "pot_amount": 0}
+
+
+def test_streams_require_a_token(client):
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/events/ws") as websocket:
+            websocket.receive_json()
+    assert client.get("/events/stream").status_code == 401
+
+
+def test_sse_stream_formats_events():
+    async def scenario():
+        subscription = events.hub.subscribe()
+        grant = _Grant(1, {"exp": time.time() + 60})
+        stream = _sse_stream(subscription, [events.pot_event(7)], grant)
+        first = await stream.__anext__()
+        events.hub.publish(events.balance_event(2, 50))
+        events.hub.publish(events.balance_event(1, 40))
+        second = await stream.__anext__()
+        await stream.aclose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == 'event: pot\ndata: {"type": "pot", "pot_amount": 7}\n\n'
+    assert second.startswith("event: balance\n")
+    assert '"balance": 40' in second
+
+
+def test_websocket_closes_when_the_token_is_revoked(client):
+    token = authenticate_user(client, "bob")
+    with client.websocket_connect(f"/events/ws?token={token}") as websocket:
+        websocket.receive_json()
+        websocket.receive_json()
+
+        client.post("/users/logout", headers={"Authorization": f"Bearer {token}"})
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+    assert closed.value.code == 1008
+    # Revocations are kept per process; later modules reuse this user id
+    auth.revoked_users.clear()
+
+
+def test_sse_stream_ends_when_the_token_expires():
+    async def scenario():
+        subscription = events.hub.subscribe()
+        grant = _Grant(1, {"exp": time.time() + 0.1})
+        stream = _sse_stream(subscription, [events.pot_event(7)], grant)
+        received = [chunk async for chunk in stream]
+        return received, subscription not in events.hub._subscribers
+
+    received, closed = asyncio.run(scenario())
+    assert received == ['event: pot\ndata: {"type": "pot", "pot_amount": 7}\n\n']
+    assert closed
+
+
+def test_slow_subscriber_drops_oldest_events():
+    async def scenario():
+        hub = events.EventHub(events.MemoryBackend(), queue_size=2)
+        await hub.start()
+        with hub.subscribe() as subscription:
+            for amount in range(5):
+                hub.publish(events.pot_event(amount))
+            # Let the backend deliver and the subscription enqueue
+            for _ in range(3):
+                await asyncio.sleep(0)
+            received = [await subscription.get(), await subscription.get()]
+        await hub.stop()
+        return received
+
+    assert [event["pot_amount"] for event in asyncio.run(scenario())] == [3, 4]
+
+
+def test_events_are_published_only_on_commit():
+    received = []
+    events.hub.on("pot", received.append)
+    db = TestingSessionLocal()
+    try:
+        crud.get_pot(db)
+        events.stage(db, events.pot_event(99))
+        db.rollback()
+        assert received == []
+
+        crud.add_to_pot(db, 3)
+        # Handlers run on commit, and again if the backend echoes the event
+        assert received and all(event == events.pot_event(3) for event in received)
+    finally:
+        crud.update_pot(db, 0)
+        db.close()
+        events.hub._handlers["pot"].remove(received.append)
+
+
+def test_pot_event_from_another_worker_invalidates_cache(client):
+    assert client.get("/pot/").json()["pot_amount"] == 0
+    db = TestingSessionLocal()
+    db.execute(update(Pot).values(amount=0))
+    db.execute(update(Pot).where(Pot.id == 1).values(amount=12))
+    db.commit()
+    db.close()
+    # Written behind this worker's back: still served from the cache
+    assert client.get("/pot/").json()["pot_amount"] == 0
+
+    # What the backend delivers when another worker commits a pot change
+    events.hub._dispatch(events.pot_event(12))
+    assert client.get("/pot/").json()["pot_amount"] == 12
+    crud.update_pot(TestingSessionLocal(), 0)
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from main import app
+from app.core import events, readiness
+from app.db.database import Base
+
+# Test database setup
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+
+# Test client
+client = TestClient(app)
+
+
+# Setup test database
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+
+
+@pytest.fixture(autouse=True)
+def database(monkeypatch):
+    # The startup checks use the app's engine rather than get_db
+    monkeypatch.setattr(readiness, "get_async_engine", lambda: async_engine)
+
+
+def stamp(*revisions):
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+        conn.execute(text("CREATE TABLE alembic_version (version_num VARCHAR(32))"))
+        for revision in revisions:
+            conn.execute(
+                text("INSERT INTO alembic_version VALUES (:revision)"),
+                {"revision": revision},
+            )
+
+
+def prepare(state):
+    async def run():
+        try:
+            await asyncio.wait_for(state.prepare(), 1)
+        finally:
+            await events.hub.stop()
+
+    asyncio.run(run())
+
+
+# Tests
+def test_healthz_needs_nothing_but_the_worker(monkeypatch):
+    monkeypatch.setattr(readiness.readiness, "ready", False)
+    response = client.get("/healthz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_readyz_reports_why_startup_has_not_finished(monkeypatch):
+    monkeypatch.setattr(readiness.readiness, "ready", False)
+    monkeypatch.setattr(readiness.readiness, "problem", "Starting")
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json() == {"status": "unavailable", "detail": "Starting"}
+
+
+def test_startup_waits_for_the_migration_head(monkeypatch):
+    monkeypatch.setattr(readiness, "FIRST_RETRY", 0.01)
+    state = readiness.Readiness()
+
+    with pytest.raises(asyncio.TimeoutError):
+        prepare(state)
+    assert not state.ready
+    assert state.problem.startswith("Database is at no revision")
+
+    stamp("0b3e5a7c9d12")
+    with pytest.raises(asyncio.TimeoutError):
+        prepare(state)
+    assert "expected" in state.problem
+
+    stamp(*readiness.head_revisions())
+    prepare(state)
+    assert state.ready and state.problem is None
+
+
+def test_readyz_passes_once_ready_and_the_database_answers(monkeypatch):
+    monkeypatch.setattr(readiness.readiness, "ready", True)
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+
+def test_readyz_fails_while_the_event_backend_is_reconnecting(monkeypatch):
+    monkeypatch.setattr(readiness.readiness, "ready", True)
+    monkeypatch.setattr(events.hub.backend, "connected", False)
+    response = client.get("/readyz")
+    assert response.status_code == 503
+    assert response.json()["detail"] == "Event backend disconnected"
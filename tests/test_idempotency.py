@@ -0,0 +1,267 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException, status
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from main import app
+from app.config import IDEMPOTENCY_LOCK_TIMEOUT, IDEMPOTENCY_TTL
+from app.db.database import Base, get_db
+from app.core import auth, idempotency, ratelimit
+from app.core.auth import hash_password
+from app.db import async_crud, crud
+from app.db.models import IdempotencyKey, Pot, User
+
+# Test database setup
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
+
+
+# Override the get_db dependency for testing
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+# Test client
+client = TestClient(app)
+
+
+# Setup test database
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    # Other test modules replace the override when they are imported
+    app.dependency_overrides[get_db] = override_get_db
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    hashed_password = hash_password("testpassword")
+    db.add(User(username="alice", hashed_password=hashed_password, balance=100))
+    db.add(User(username="bob", hashed_password=hashed_password, balance=100))
+    db.add(Pot(amount=0))
+    db.commit()
+    db.close()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(autouse=True)
+def key_store(monkeypatch):
+    # The middleware opens its own sessions rather than going through get_db
+    monkeypatch.setattr(idempotency, "AsyncSessionLocal", TestingAsyncSessionLocal)
+
+
+def auth_headers(username, key=None):
+    response = client.post(
+        "/users/login", json={"username": username, "password": "testpassword"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    if key is not None:
+        headers["Idempotency-Key"] = key
+    return headers
+
+
+def balance(username):
+    return client.get("/currency/balance", headers=auth_headers(username)).json()[
+        "balance"
+    ]
+
+
+# Tests
+def test_retry_replays_the_stored_response():
+    headers = auth_headers("alice", "deduct-1")
+    start = balance("alice")
+
+    first = client.post("/currency/deduct", params={"cost": 10}, headers=headers)
+    retry = client.post("/currency/deduct", params={"cost": 10}, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert balance("alice") == start - 10
+
+
+def test_requests_without_a_key_are_not_deduplicated():
+    start = balance("alice")
+    for _ in range(2):
+        client.post(
+            "/currency/deduct", params={"cost": 1}, headers=auth_headers("alice")
+        )
+    assert balance("alice") == start - 2
+
+
+def test_key_reused_for_another_request_is_rejected():
+    headers = auth_headers("alice", "contribute-1")
+    response = client.post(
+        "/pot/contribute", params={"contribution": 2}, headers=headers
+    )
+    assert response.status_code == 200
+
+    response = client.post(
+        "/pot/contribute", params={"contribution": 3}, headers=headers
+    )
+    assert response.status_code == 422
+
+
+def test_keys_are_scoped_to_the_user():
+    alice_start, bob_start = balance("alice"), balance("bob")
+    for username in ("alice", "bob"):
+        response = client.post(
+            "/currency/deduct",
+            params={"cost": 5},
+            headers=auth_headers(username, "shared-key"),
+        )
+        assert response.status_code == 200
+    assert balance("alice") == alice_start - 5
+    assert balance("bob") == bob_start - 5
+
+
+def test_client_errors_are_replayed_and_auth_failures_are_not():
+    headers = auth_headers("bob", "too-much")
+    first = client.post("/currency/deduct", params={"cost": 10**6}, headers=headers)
+    retry = client.post("/currency/deduct", params={"cost": 10**6}, headers=headers)
+    assert first.status_code == retry.status_code == 400
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+    # A token that does not verify never claims the key
+    bad = {"Authorization": "Bearer nope", "Idempotency-Key": "unclaimed"}
+    assert (
+        client.post("/currency/deduct", params={"cost": 1}, headers=bad).status_code
+        == 401
+    )
+    db = TestingSessionLocal()
+    assert db.get(IdempotencyKey, (2, "unclaimed")) is None
+    db.close()
+
+
+def test_requests_over_the_rate_limit_never_claim_a_key(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "backend", ratelimit.MemoryBackend())
+    charged = []
+    take = ratelimit.backend.take
+
+    async def counting_take(key, limit):
+        if key.startswith("contribute:"):
+            charged.append(key)
+        return await take(key, limit)
+
+    monkeypatch.setattr(ratelimit.backend, "take", counting_take)
+    headers = auth_headers("alice")
+    statuses = [
+        client.post(
+            "/pot/contribute",
+            params={"contribution": 1},
+            headers={**headers, "Idempotency-Key": f"limited-{attempt}"},
+        ).status_code
+        for attempt in range(6)
+    ]
+    assert statuses == [200] * 5 + [429]
+    # Charged once per request, by the middleware rather than the route too
+    assert len(charged) == 6
+    db = TestingSessionLocal()
+    assert db.get(IdempotencyKey, (1, "limited-5")) is None
+    db.close()
+
+
+def test_stored_responses_are_not_replayed_to_revoked_tokens():
+    headers = auth_headers("bob", "before-logout")
+    first = client.post("/currency/deduct", params={"cost": 1}, headers=headers)
+    assert first.status_code == 200
+
+    client.post("/users/logout", headers=headers)
+    retry = client.post("/currency/deduct", params={"cost": 1}, headers=headers)
+    assert retry.status_code == 401
+    assert "Idempotent-Replayed" not in retry.headers
+    # Revocations are kept per process; later modules reuse this user id
+    auth.revoked_users.clear()
+
+
+def test_concurrent_duplicates_are_coalesced():
+    headers = auth_headers("bob", "send-1")
+
+    async def send_twice():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            return await asyncio.gather(
+                *(c.post("/messages/send", headers=headers) for _ in range(2))
+            )
+
+    first, second = asyncio.run(send_twice())
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    replayed = [r.headers.get("Idempotent-Replayed") for r in (first, second)]
+    assert replayed.count("true") == 1
+    # Only one message was sent and paid for
+    db = TestingSessionLocal()
+    assert crud.get_user_totals(db, 2)[1] == 1
+    db.close()
+
+
+def test_duplicates_run_again_when_the_first_request_stores_nothing(monkeypatch):
+    headers = auth_headers("alice", "flaky")
+    start = balance("alice")
+    update_user_balance = async_crud.update_user_balance
+    calls = []
+
+    async def fail_first(db, user_id, amount):
+        calls.append(amount)
+        if len(calls) == 1:
+            # Long enough for the duplicate to start waiting on this request
+            await asyncio.sleep(0.05)
+            raise HTTPException(status.HTTP_503_SERVICE_UNAVAILABLE, "Try again")
+        return await update_user_balance(db, user_id, amount)
+
+    monkeypatch.setattr(async_crud, "update_user_balance", fail_first)
+
+    async def deduct_twice():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            return await asyncio.gather(
+                *(
+                    c.post("/currency/deduct", params={"cost": 3}, headers=headers)
+                    for _ in range(2)
+                )
+            )
+
+    first, second = asyncio.run(deduct_twice())
+    assert [first.status_code, second.status_code] == [503, 200]
+    # Neither response was replayed: the 503 was never stored
+    assert "Idempotent-Replayed" not in first.headers
+    assert "Idempotent-Replayed" not in second.headers
+    assert balance("alice") == start - 3
+
+    retry = client.post("/currency/deduct", params={"cost": 3}, headers=headers)
+    assert retry.json() == second.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+
+def test_claims_expire_and_stale_reservations_are_taken_over():
+    db = TestingSessionLocal()
+    now = 1_000_000.0
+    assert crud.claim_idempotency_key(db, 99, "k", "a", now) is None
+    # Still running: another worker is told it is busy
+    holder = crud.claim_idempotency_key(db, 99, "k", "a", now + 1)
+    assert holder["status_code"] is None
+    # The first request died; after the lock timeout the key can be claimed again
+    later = now + IDEMPOTENCY_LOCK_TIMEOUT + 1
+    assert crud.claim_idempotency_key(db, 99, "k", "a", later) is None
+
+    crud.save_idempotent_response(db, 99, "k", 200, "{}")
+    holder = crud.claim_idempotency_key(db, 99, "k", "a", later + 1)
+    assert (holder["status_code"], holder["body"]) == (200, "{}")
+
+    assert crud.purge_idempotency_keys(db, later + IDEMPOTENCY_TTL + 1) >= 1
+    assert db.get(IdempotencyKey, (99, "k")) is None
+    db.close()
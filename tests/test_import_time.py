@@ -0,0 +1,55 @@
+import subprocess
+import sys
+
+from benchmarks import importtime
+
+
+def run_python(code):
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=importtime.ROOT,
+    )
+
+
+# Tests
+def test_importing_the_app_leaves_drivers_and_crypto_for_first_use():
+    modules = importtime.measure("main")["modules"]
+    assert importtime.lazy_modules_loaded(modules) == []
+
+
+def test_schemas_import_without_the_database_layer():
+    modules = importtime.measure("app.schemas.user")["modules"]
+    assert "sqlalchemy" not in modules
+    assert "app.db.database" not in modules
+
+
+def test_create_app_creates_engines_only_when_used():
+    result = run_python(
+        "from app.config import Settings\n"
+        "from app.db import database\n"
+        "from main import create_app\n"
+        "create_app(Settings(database_url='sqlite:///./factory.db'))\n"
+        "assert not database._engines\n"
+        "print(database.get_async_engine().url)\n"
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "sqlite+aiosqlite:///./factory.db"
+
+
+def test_create_app_cannot_move_engines_already_in_use():
+    result = run_python(
+        "from app.config import Settings\n"
+        "from app.db import database\n"
+        "from main import create_app\n"
+        "create_app(Settings(database_url='sqlite:///./factory.db'))\n"
+        "database.get_async_engine()\n"
+        "create_app(Settings(database_url='sqlite:///./factory.db'))\n"
+        "try:\n"
+        "    create_app(Settings(database_url='sqlite:///./other.db'))\n"
+        "except RuntimeError:\n"
+        "    print('refused')\n"
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "refused"
@@ -0,0 +1,164 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from main import app
+from app.db.database import Base, get_db
+from app.core.auth import hash_password
+from app.core import events
+from app.core.leaderboard import Leaderboard, Ranking, leaderboard
+from app.db import async_crud, crud
+from app.db.models import Pot, User
+from app.routers import messaging
+
+# Test database setup
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
+
+
+# Override the get_db dependency for testing
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+# Test client
+client = TestClient(app)
+
+
+# Setup test database
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    # Other test modules replace the override when they are imported
+    app.dependency_overrides[get_db] = override_get_db
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    hashed_password = hash_password("testpassword")
+    for username, balance in (("carol", 300), ("dave", 200), ("erin", 100)):
+        db.add(
+            User(username=username, hashed_password=hashed_password, balance=balance)
+        )
+    db.add(Pot(amount=0))
+    db.commit()
+    # Pending ledger rows count towards the rankings before any compaction
+    erin = db.query(User).filter(User.username == "erin").one()
+    crud.record_transaction(db, erin.id, 350, "adjustment")
+    db.commit()
+    db.close()
+    # Other modules' users went into the rankings through their events
+    leaderboard.invalidate()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def headers_for(username):
+    response = client.post(
+        "/users/login", json={"username": username, "password": "testpassword"}
+    )
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def ranking(by, limit=10):
+    response = client.get("/users/leaderboard", params={"by": by, "limit": limit})
+    assert response.status_code == 200
+    return [(entry["username"], entry["value"]) for entry in response.json()["entries"]]
+
+
+# Tests
+def test_ranking_stays_exact_as_values_fall():
+    board = Ranking(capacity=3)
+    board.load([(1, 50), (2, 40), (3, 30)])
+    assert not board.complete
+
+    # User 4 is unknown to the ranking, so it can only enter above the last entry
+    board.set(4, 10)
+    assert board.top(5) == [(1, 50), (2, 40), (3, 30)]
+    board.set(4, 45)
+    assert board.top(5) == [(1, 50), (4, 45), (2, 40)]
+
+    # Falling below the last entry means someone untracked may now be ahead
+    board.set(1, 0)
+    assert board.top(5) == [(4, 45), (2, 40)]
+    assert board.covers(2) and not board.covers(3)
+
+
+def test_complete_ranking_accepts_any_value():
+    board = Ranking(capacity=3)
+    board.load([(1, 50)])
+    assert board.complete
+    board.set(2, 1)
+    board.add(2, 0)  # A late registration event does not undo a later change
+    assert board.top(5) == [(1, 50), (2, 1)]
+
+
+def test_events_older_than_the_applied_value_are_ignored():
+    board = Leaderboard(size=5)
+    for board_ranking in board.rankings.values():
+        board_ranking.load([])
+    board.apply(events.balance_event(1, 80, message_count=2, ledger_id=7))
+    # Another worker's echo of an earlier change, then of the same one
+    board.apply(events.balance_event(1, 90, message_count=1, ledger_id=6))
+    board.apply(events.balance_event(1, 80, message_count=2, ledger_id=7))
+    # A late registration event
+    board.apply(events.user_event(1, "alice", 100))
+    assert board.rankings["balance"].top(5) == [(1, 80)]
+    assert board.rankings["messages"].top(5) == [(1, 2)]
+
+    board.apply(events.win_event(1, 30, wins=2, ledger_id=9))
+    board.apply(events.win_event(1, 10, wins=1, ledger_id=8))
+    assert board.rankings["wins"].top(5) == [(1, 2)]
+
+
+def test_leaderboard_counts_uncompacted_transactions():
+    assert ranking("balance") == [("erin", 450), ("carol", 300), ("dave", 200)]
+    assert ranking("balance", limit=1) == [("erin", 450)]
+    assert client.get("/users/leaderboard", params={"by": "karma"}).status_code == 422
+
+    # Reading the rankings left the ledger to the background compaction
+    db = TestingSessionLocal()
+    erin = db.query(User).filter(User.username == "erin").one()
+    assert (erin.balance, erin.ledger_cursor) == (100, 0)
+    db.close()
+
+
+def test_writes_update_the_rankings_without_reloading(monkeypatch):
+    ranking("balance")
+
+    async def no_reload(*args):
+        raise AssertionError("leaderboard reloaded")
+
+    monkeypatch.setattr(async_crud, "get_leaderboards", no_reload)
+    monkeypatch.setattr(messaging, "_draw", lambda pot_amount: True)
+
+    client.post("/currency/deduct", params={"cost": 400}, headers=headers_for("erin"))
+    assert ranking("balance") == [("carol", 300), ("dave", 200), ("erin", 50)]
+
+    client.post("/messages/send", headers=headers_for("dave"))
+    assert ranking("messages")[0] == ("dave", 1)
+    assert ranking("wins")[0] == ("dave", 1)
+
+    response = client.post(
+        "/users/register", json={"username": "frank", "password": "testpassword"}
+    )
+    assert response.status_code == 200
+    assert ("frank", 100) in ranking("balance")
+
+
+def test_bulk_import_reloads_the_rankings():
+    db = TestingSessionLocal()
+    crud.create_users(
+        db, [{"username": "grace", "hashed_password": hash_password("x")}]
+    )
+    db.close()
+    assert not leaderboard.fresh("balance", 1)
+    assert ("grace", 100) in ranking("balance")
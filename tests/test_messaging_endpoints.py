@@ -1,27 +1,36 @@
+from datetime import datetime, timedelta
+
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from main import app
 from app.db.database import Base, get_db
 from app.core.auth import hash_password
-from app.db.models import User, Pot
+from app.core import draws, pricing
+from app.db import crud
+from app.db.models import Pot, Transaction, User
+from app.routers import messaging
 
 # Test database setup
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
 
 
 # Override the get_db dependency for testing
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
@@ -52,10 +61,18 @@ def setup_database():
 
     db.commit()
     db.close()
+    # Other modules may have left their pot amount in the cache
+    crud.pot_cache.invalidate()
     yield
     Base.metadata.drop_all(bind=engine)
 
 
+@pytest.fixture(autouse=True)
+def seeded_draws(monkeypatch):
+    # Every test sees the same rolls: the first three lose, the fourth wins
+    monkeypatch.setattr(draws, "engine", draws.DrawEngine(seed=b"messaging-5"))
+
+
 # Helper function to get token
 def authenticate_user():
     response = client.post(
@@ -109,7 +126,7 @@ def test_send_message_with_winning_logic():
             headers={"Authorization": f"Bearer {token}"},
         )
 
-    # Simulate multiple messages to ensure a chance of winning
+    # The seeded draws win on the fourth message
     for _ in range(20):
         response = client.post(
             "/messages/send",
@@ -166,3 +183,230 @@ def test_insufficient_balance_for_message():
     assert (
         balance < next_message_cost
     )  # Balance must be insufficient for the next message
+
+
+def test_rejected_message_leaves_no_partial_writes():
+    token = authenticate_user()
+    before = client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    pot_before = client.get("/pot/").json()["pot_amount"]
+
+    response = client.post(
+        "/messages/send",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 400
+
+    after = client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert after.json()["message_count"] == before.json()["message_count"]
+    assert after.json()["balance"] == before.json()["balance"]
+    assert client.get("/pot/").json()["pot_amount"] == pot_before
+
+
+def test_send_batch_charges_cumulative_cost(monkeypatch):
+    monkeypatch.setattr(messaging, "_batch_draw", lambda count: lambda pot: False)
+    db = TestingSessionLocal()
+    db.add(User(username="batchuser", hashed_password=hash_password("batchpassword")))
+    db.commit()
+    db.close()
+    response = client.post(
+        "/users/login", json={"username": "batchuser", "password": "batchpassword"}
+    )
+    token = response.json()["access_token"]
+    pot_before = client.get("/pot/").json()["pot_amount"]
+
+    response = client.post(
+        "/messages/send-batch",
+        json={"count": 3},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["sent"] == 3
+    assert [outcome["cost"] for outcome in result["results"]] == [5, 10, 15]
+    assert result["total_cost"] == 30
+    assert result["balance"] == 70
+    assert client.get("/pot/").json()["pot_amount"] == pot_before + 30
+
+
+def test_send_batch_pays_out_wins_and_stops_when_unaffordable(monkeypatch):
+    def win_first(count):
+        rolls = iter([True] + [False] * (count - 1))
+        return lambda pot: next(rolls)
+
+    monkeypatch.setattr(messaging, "_batch_draw", win_first)
+    response = client.post(
+        "/users/login", json={"username": "batchuser", "password": "batchpassword"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    pot_before = client.get("/pot/").json()["pot_amount"]
+
+    response = client.post("/messages/send-batch", json={"count": 20}, headers=headers)
+    assert response.status_code == 200
+    result = response.json()
+    first, rest = result["results"][0], result["results"][1:]
+    assert first["won"] and first["message"] == "Congratulations! You won the pot!"
+    assert first["pot_amount"] == pot_before + 20
+    assert 1 < result["sent"] < 20
+    assert result["pot_amount"] == sum(outcome["cost"] for outcome in rest)
+    assert client.get("/pot/").json()["pot_amount"] == result["pot_amount"]
+
+    balance = client.get("/currency/balance", headers=headers).json()["balance"]
+    assert balance == result["balance"]
+    assert balance < 5 * (result["results"][-1]["message_count"] + 1)
+
+    response = client.post("/messages/send-batch", json={"count": 1}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Insufficient balance"
+
+
+def test_send_batch_draws_against_the_locked_pot(monkeypatch):
+    seen = []
+
+    def win_first(count):
+        rolls = iter([True] + [False] * (count - 1))
+
+        def draw(pot):
+            seen.append(pot)
+            return next(rolls)
+
+        return draw
+
+    monkeypatch.setattr(messaging, "_batch_draw", win_first)
+    db = TestingSessionLocal()
+    db.add(
+        User(
+            username="staleuser",
+            hashed_password=hash_password("stalepassword"),
+            balance=10,
+        )
+    )
+    db.commit()
+    crud.update_pot(db, 0)
+    db.close()
+    response = client.post(
+        "/users/login", json={"username": "staleuser", "password": "stalepassword"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    # An unlocked read would see a pot of 1000 that someone else has won since
+    with monkeypatch.context() as stale:
+        stale.setattr(crud, "get_pot", lambda db: 1000)
+        response = client.post(
+            "/messages/send-batch", json={"count": 20}, headers=headers
+        )
+    assert response.status_code == 200
+    result = response.json()
+    # Winning the 5 it paid in leaves 10, enough for one more message
+    assert seen == [5, 10]
+    assert result["sent"] == 2
+    assert result["results"][0]["pot_amount"] == 5
+    assert result["balance"] == 0
+    assert result["pot_amount"] == 10
+    assert client.get("/currency/balance", headers=headers).json()["balance"] == 0
+    assert client.get("/pot/").json()["pot_amount"] == 10
+
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.username == "staleuser").one()
+    rows = (
+        db.query(Transaction.reason, Transaction.delta, Transaction.pot_id)
+        .filter(Transaction.user_id == user.id)
+        .order_by(Transaction.id)
+        .all()
+    )
+    # The won message's cost was paid straight back out; the other one's
+    # is in the sender's shard
+    assert rows == [
+        ("message", -5, None),
+        ("pot_win", 5, None),
+        ("message", -10, crud._pot_shard_id(user.id)),
+    ]
+    crud.compact_ledger(db)
+    db.refresh(user)
+    assert (user.balance, user.message_count) == (0, 2)
+    db.close()
+
+
+def test_message_count_survives_ledger_compaction(monkeypatch):
+    monkeypatch.setattr(messaging, "_draw", lambda pot_amount: False)
+    token = authenticate_user()
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/currency/deduct", params={"cost": -1000}, headers=headers)
+    before = client.get("/users/me", headers=headers).json()["message_count"]
+
+    client.post("/messages/send", headers=headers)
+    client.post("/messages/send", headers=headers)
+    assert client.get("/users/me", headers=headers).json()["message_count"] == (
+        before + 2
+    )
+
+    db = TestingSessionLocal()
+    crud.compact_ledger(db)
+    user = db.query(User).filter(User.username == "testuser").one()
+    assert user.message_count == before + 2
+    db.close()
+
+    response = client.post("/messages/send", headers=headers)
+    assert client.get("/users/me", headers=headers).json()["message_count"] == (
+        before + 3
+    )
+    assert response.status_code == 200
+
+
+def test_quote_prices_the_next_messages_without_writing():
+    token = authenticate_user()
+    headers = {"Authorization": f"Bearer {token}"}
+    me = client.get("/users/me", headers=headers).json()
+    count = me["message_count"]
+
+    response = client.get("/messages/quote", params={"count": 3}, headers=headers)
+    assert response.status_code == 200
+    quote = response.json()
+    assert quote["message_count"] == count
+    assert quote["next_cost"] == 5 * (count + 1)
+    assert quote["total_cost"] == 5 * (count + 1) + 5 * (count + 2) + 5 * (count + 3)
+    assert quote["balance"] == me["balance"]
+    assert quote["affordable"] == sum(
+        1
+        for n in range(1, 4)
+        if sum(5 * (count + i) for i in range(1, n + 1)) <= me["balance"]
+    )
+    assert client.get("/users/me", headers=headers).json() == me
+
+    response = client.get("/messages/quote", params={"count": 0}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_time_decay_prices_only_recent_messages(monkeypatch):
+    monkeypatch.setattr(messaging, "_draw", lambda pot_amount: False)
+    monkeypatch.setattr(
+        pricing, "engine", pricing.PricingEngine(pricing.linear(5, 5), window=3600)
+    )
+    db = TestingSessionLocal()
+    db.add(User(username="decayuser", hashed_password=hash_password("decaypassword")))
+    db.commit()
+    response = client.post(
+        "/users/login", json={"username": "decayuser", "password": "decaypassword"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    client.post("/messages/send", headers=headers)
+    client.post("/messages/send", headers=headers)
+    quote = client.get("/messages/quote", headers=headers).json()
+    assert (quote["message_count"], quote["next_cost"]) == (2, 15)
+
+    # Once the messages are older than the window they no longer raise the price
+    user_id = db.query(User.id).filter(User.username == "decayuser").scalar()
+    db.execute(
+        update(Transaction)
+        .where(Transaction.user_id == user_id)
+        .values(created_at=datetime.utcnow() - timedelta(hours=2))
+    )
+    db.commit()
+    db.close()
+    quote = client.get("/messages/quote", headers=headers).json()
+    assert (quote["message_count"], quote["next_cost"]) == (2, 5)
+    response = client.post("/messages/send", headers=headers)
+    assert response.json()["message"] == "Sorry, better luck next time!"
+    assert client.get("/currency/balance", headers=headers).json()["balance"] == (
+        100 - 5 - 10 - 5
+    )
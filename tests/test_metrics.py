@@ -0,0 +1,137 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from main import app
+from app.db.database import Base, PoolCheckoutStats, get_db
+from app.core import metrics
+from app.core.auth import hash_password
+from app.db import crud
+from app.db.models import User, Pot
+
+# Test database setup
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
+metrics.instrument_engine(async_engine.sync_engine)
+
+
+# Override the get_db dependency for testing
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+# Test client
+client = TestClient(app)
+
+
+# Setup test database
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    # Other test modules replace the override when they are imported
+    app.dependency_overrides[get_db] = override_get_db
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    hashed_password = hash_password("testpassword")
+    db.add(
+        User(
+            username="testuser",
+            hashed_password=hashed_password,
+            balance=1000,
+            message_count=0,
+        )
+    )
+    db.add(Pot(amount=0))
+    db.commit()
+    db.close()
+    # Other modules may have left their pot amount in the cache
+    crud.pot_cache.invalidate()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+def scrape():
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    return response.text
+
+
+def sample(text, name):
+    """Value of the first sample whose name and labels start with ``name``."""
+    for line in text.splitlines():
+        if line.startswith(name):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+# Tests
+def test_request_latency_and_sql_are_recorded_per_route():
+    before = scrape()
+    crud.pot_cache.invalidate()
+    assert client.get("/pot/").status_code == 200
+    after = scrape()
+
+    count = 'http_requests_total{method="GET",route="/pot/",status="200"}'
+    assert sample(after, count) == sample(before, count) + 1
+    latency = 'http_request_duration_seconds_count{method="GET",route="/pot/"}'
+    assert sample(after, latency) == sample(before, latency) + 1
+    statements = 'db_statements_per_request_sum{route="/pot/"}'
+    assert sample(after, statements) == sample(before, statements) + 1
+    assert 'db_statements_per_request_bucket{route="/pot/",le="+Inf"}' in after
+
+
+def test_password_hashing_and_pot_draws_are_counted():
+    before = scrape()
+    response = client.post(
+        "/users/login", json={"username": "testuser", "password": "testpassword"}
+    )
+    token = response.json()["access_token"]
+    client.post("/messages/send", headers={"Authorization": f"Bearer {token}"})
+    after = scrape()
+
+    verify = 'password_hash_duration_seconds_count{operation="verify"}'
+    assert sample(after, verify) == sample(before, verify) + 1
+    draws = sum(
+        sample(after, f'pot_draws_total{{outcome="{outcome}"}}')
+        - sample(before, f'pot_draws_total{{outcome="{outcome}"}}')
+        for outcome in ("win", "loss")
+    )
+    assert draws == 1
+
+
+def test_pool_checkout_waits_are_a_histogram():
+    stats = PoolCheckoutStats()
+    metrics.instrument_engine(async_engine.sync_engine, stats)
+    before = sample(scrape(), "db_pool_checkout_wait_seconds_count")
+    stats.record(0.002)
+    after = scrape()
+    assert "# TYPE db_pool_checkout_wait_seconds histogram" in after
+    assert sample(after, "db_pool_checkout_wait_seconds_count") == before + 1
+    assert 'db_pool_checkout_wait_seconds_bucket{le="0.005"}' in after
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_histogram", "Test.", ["kind"], buckets=(1, 5))
+    try:
+        for value in (0.5, 3, 3, 10):
+            histogram.observe(value, kind="a")
+        lines = histogram.render()
+    finally:
+        metrics._registry.remove(histogram)
+
+    assert 'test_histogram_bucket{kind="a",le="1"} 1' in lines
+    assert 'test_histogram_bucket{kind="a",le="5"} 3' in lines
+    assert 'test_histogram_bucket{kind="a",le="+Inf"} 4' in lines
+    assert 'test_histogram_sum{kind="a"} 16.5' in lines
+    assert 'test_histogram_count{kind="a"} 4' in lines
@@ -1,27 +1,35 @@
+import asyncio
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from main import app
 from app.db.database import Base, get_db
 from app.core.auth import hash_password
+from app.core.cache import ReadThroughCache
+from app.db import crud
 from app.db.models import User, Pot
 
 # Test database setup
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
 
 
 # Override the get_db dependency for testing
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
@@ -46,6 +54,8 @@ def setup_database():
 
     db.commit()
     db.close()
+    # Other modules may have left their pot amount in the cache
+    crud.pot_cache.invalidate()
     yield
     Base.metadata.drop_all(bind=engine)
 
@@ -90,3 +100,79 @@ def test_reset_pot():
     )
     assert response.status_code == 200
     assert response.json()["new_pot_amount"] == 0
+
+
+def test_contributions_across_shards_are_summed():
+    token = authenticate_user()
+    db = TestingSessionLocal()
+    for shard_key in range(3):
+        crud.add_to_pot(db, 10, shard_key)
+    db.close()
+
+    response = client.get("/pot/")
+    assert response.status_code == 200
+    assert response.json()["pot_amount"] == 30
+
+    response = client.post(
+        "/pot/reset",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.json()["new_pot_amount"] == 0
+    assert client.get("/pot/").json()["pot_amount"] == 0
+
+
+def test_pot_supports_conditional_requests():
+    response = client.get("/pot/")
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+
+    response = client.get("/pot/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    token = authenticate_user()
+    client.post(
+        "/pot/contribute",
+        params={"contribution": 5},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    response = client.get("/pot/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    client.post("/pot/reset", headers={"Authorization": f"Bearer {token}"})
+
+
+def test_concurrent_reads_share_one_load():
+    loads = 0
+
+    async def load():
+        nonlocal loads
+        loads += 1
+        await asyncio.sleep(0.01)
+        return 42
+
+    async def read_concurrently():
+        cache = ReadThroughCache(ttl=60)
+        values = await asyncio.gather(*(cache.get(load) for _ in range(20)))
+        return values, await cache.get(load)
+
+    values, cached = asyncio.run(read_concurrently())
+    assert values == [42] * 20 and cached == 42
+    assert loads == 1
+
+
+def test_invalidate_discards_load_in_flight():
+    async def scenario():
+        cache = ReadThroughCache(ttl=60)
+        stale = asyncio.ensure_future(cache.get(lambda: asyncio.sleep(0.01, "stale")))
+        await asyncio.sleep(0)
+        cache.invalidate()
+        await stale
+
+        async def fresh():
+            return "fresh"
+
+        return await cache.get(fresh)
+
+    assert asyncio.run(scenario()) == "fresh"
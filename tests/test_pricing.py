@@ -0,0 +1,64 @@
+import pytest
+
+from app.core import pricing
+
+
+def test_linear_schedule_matches_the_original_pricing():
+    engine = pricing.PricingEngine(pricing.linear(5, 5))
+    assert [engine.cost(n) for n in range(1, 5)] == [5, 10, 15, 20]
+    assert engine.quote(0, 3) == 30
+    assert engine.quote(2, 2) == 15 + 20
+
+
+def test_table_grows_past_its_initial_size():
+    engine = pricing.PricingEngine(pricing.linear(5, 5), table_size=4)
+    assert engine.quote(100, 10) == sum(5 * n for n in range(101, 111))
+    assert engine.cost(5000) == 25000
+
+
+def test_affordable_counts_whole_messages_only():
+    engine = pricing.PricingEngine(pricing.linear(5, 5))
+    assert engine.affordable(0, 10, 29) == 2
+    assert engine.affordable(0, 10, 30) == 3
+    assert engine.affordable(0, 2, 10**6) == 2
+    assert engine.affordable(3, 5, 0) == 0
+
+
+def test_tiered_schedule():
+    engine = pricing.PricingEngine(pricing.tiered("1:5,10:10,100:25"))
+    assert [engine.cost(n) for n in (1, 9, 10, 99, 100, 10**4)] == [
+        5,
+        5,
+        10,
+        10,
+        25,
+        25,
+    ]
+    with pytest.raises(ValueError):
+        pricing.tiered("5:5")
+
+
+def test_exponential_schedule_is_capped():
+    engine = pricing.PricingEngine(
+        pricing.exponential(5, 2.0, 1000), max_cost=1000, table_size=8
+    )
+    assert [engine.cost(n) for n in range(1, 9)] == [5, 10, 20, 40, 80, 160, 320, 640]
+    assert engine.cost(9) == engine.cost(10**5) == 1000
+
+
+def test_table_stops_growing_once_prices_are_constant():
+    schedule = pricing.linear(5, 5, max_cost=100)
+    engine = pricing.PricingEngine(schedule, table_size=4)
+    prices = [schedule(n) for n in range(1, 41)]
+    assert engine.quote(0, 40) == sum(prices)
+    assert engine.cost(10**9) == 100
+    assert engine.quote(10**9, 3) == 300
+    assert engine.affordable(15, 10, 250) == 2
+    assert engine.affordable(18, 10**6, 10**4) == 100
+    assert engine.affordable(10**12, 5, 10**6) == 5
+    # The price settles at the 20th message, so the table ends there
+    assert len(engine._table) == 21
+
+    tiers = pricing.PricingEngine(pricing.tiered("1:5,10:10,100:25"))
+    assert tiers.quote(99, 10**6) == 25 * 10**6
+    assert len(tiers._table) == 101
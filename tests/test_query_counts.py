@@ -0,0 +1,139 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from main import app
+from app.db.database import Base, get_db
+from app.core.auth import hash_password
+from app.db import crud
+from app.db.models import User, Pot
+from app.routers import messaging
+
+# Test database setup
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
+
+statements = []
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+# Override the get_db dependency for testing
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+app.dependency_overrides[get_db] = override_get_db
+
+# Test client
+client = TestClient(app)
+
+
+# Setup test database
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    # Other test modules replace the override when they are imported
+    app.dependency_overrides[get_db] = override_get_db
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    hashed_password = hash_password("testpassword")
+    db.add(
+        User(
+            username="testuser",
+            hashed_password=hashed_password,
+            balance=1000,
+            message_count=0,
+        )
+    )
+    db.add(Pot(amount=0))
+    db.commit()
+    db.close()
+    # Other modules may have left their pot amount in the cache
+    crud.pot_cache.invalidate()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="module")
+def token():
+    response = client.post(
+        "/users/login", json={"username": "testuser", "password": "testpassword"}
+    )
+    return response.json()["access_token"]
+
+
+def count_statements(method, url, **kwargs):
+    statements.clear()
+    response = client.request(method, url, **kwargs)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.mark.parametrize(
+    "method, url, expected",
+    [
+        ("GET", "/users/me", 2),
+        ("GET", "/currency/balance", 2),
+        ("POST", "/currency/deduct?cost=1", 3),
+        ("GET", "/pot/", 1),
+        ("POST", "/pot/contribute?contribution=1", 3),
+        ("GET", "/messages/quote?count=10", 2),
+    ],
+)
+def test_statements_per_request(token, method, url, expected):
+    headers = {"Authorization": f"Bearer {token}"}
+    assert count_statements(method, url, headers=headers) == expected
+
+
+def test_registration_is_one_statement():
+    body = {"username": "newcomer", "password": "testpassword"}
+    assert count_statements("POST", "/users/register", json=body) == 1
+
+
+def test_cached_pot_read_issues_no_statements(token):
+    crud.pot_cache.invalidate()
+    assert count_statements("GET", "/pot/") == 1
+    assert count_statements("GET", "/pot/") == 0
+    count_statements(
+        "POST",
+        "/pot/contribute?contribution=1",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert count_statements("GET", "/pot/") == 1
+
+
+def test_statements_per_message_send(token, monkeypatch):
+    monkeypatch.setattr(messaging, "_draw", lambda pot_amount: False)
+    headers = {"Authorization": f"Bearer {token}"}
+    assert count_statements("POST", "/messages/send", headers=headers) == 5
+
+    # A win drains the pot instead of crediting a shard, then records the
+    # payout and reads the winner's new win total
+    monkeypatch.setattr(messaging, "_draw", lambda pot_amount: True)
+    assert count_statements("POST", "/messages/send", headers=headers) == 8
+
+
+def test_statements_per_message_batch(token, monkeypatch):
+    monkeypatch.setattr(messaging, "_batch_draw", lambda count: lambda pot: False)
+    headers = {"Authorization": f"Bearer {token}"}
+    # The pot is locked and reset up front, then credited once
+    assert (
+        count_statements(
+            "POST", "/messages/send-batch", json={"count": 3}, headers=headers
+        )
+        == 6
+    )
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from main import app
+from app.db.database import Base, get_db
+from app.core import ratelimit
+from app.core.auth import hash_password
+from app.db import crud
+from app.db.models import User, Pot
+
+# Test database setup
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
+
+
+# Override the get_db dependency for testing
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
+# Test client
+client = TestClient(app)
+
+
+# Setup test database
+@pytest.fixture(scope="module", autouse=True)
+def setup_database():
+    # Other test modules replace the override when they are imported
+    app.dependency_overrides[get_db] = override_get_db
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    hashed_password = hash_password("testpassword")
+    db.add(User(username="alice", hashed_password=hashed_password, balance=100))
+    db.add(User(username="bob", hashed_password=hashed_password, balance=100))
+    db.add(Pot(amount=0))
+    db.commit()
+    db.close()
+    yield
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def limited(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(ratelimit, "backend", ratelimit.MemoryBackend())
+
+
+def authenticate_user(username):
+    response = client.post(
+        "/users/login", json={"username": username, "password": "testpassword"}
+    )
+    return response.json()["access_token"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# Tests
+def test_memory_bucket_refills_over_time():
+    clock = FakeClock()
+    backend = ratelimit.MemoryBackend(clock=clock)
+    limit = ratelimit.parse_limit("2/10")
+
+    async def take():
+        return await backend.take("key", limit)
+
+    assert asyncio.run(take()) == 0
+    assert asyncio.run(take()) == 0
+    assert asyncio.run(take()) == pytest.approx(5)
+    clock.now += 5
+    assert asyncio.run(take()) == 0
+    assert asyncio.run(take()) > 0
+
+
+def test_database_bucket_is_shared_and_refills():
+    db = TestingSessionLocal()
+    take = lambda now: crud.take_rate_limit_token(db, "shared", 0.5, 2, now)
+    assert [take(100.0), take(100.0), take(100.0)] == [True, True, False]
+    assert take(101.0) is False
+    assert take(102.0) is True
+    # A long pause refills only up to the burst
+    assert [take(1000.0), take(1000.0), take(1000.0)] == [True, True, False]
+    db.close()
+
+
+def test_per_user_limit_returns_retry_after(limited):
+    alice = {"Authorization": f"Bearer {authenticate_user('alice')}"}
+    bob = {"Authorization": f"Bearer {authenticate_user('bob')}"}
+    statuses = [
+        client.post("/pot/contribute", params={"contribution": 1}, headers=alice)
+        for _ in range(6)
+    ]
+    assert [response.status_code for response in statuses] == [200] * 5 + [429]
+    assert int(statuses[-1].headers["Retry-After"]) >= 1
+
+    # Bob has his own bucket
+    response = client.post("/pot/contribute", params={"contribution": 1}, headers=bob)
+    assert response.status_code == 200
+
+
+def test_rejected_login_never_checks_the_password(limited, monkeypatch):
+    monkeypatch.setattr(ratelimit, "backend", ratelimit.MemoryBackend(maxsize=10))
+    limit = ratelimit.parse_limit("1/60")
+    asyncio.run(ratelimit.backend.take("login:ip:testclient", limit))
+    asyncio.run(ratelimit.backend.take("login:ip:testclient", limit))
+
+    async def fail(*args):
+        raise AssertionError("password checked")
+
+    monkeypatch.setattr("app.routers.user.verify_and_update_async", fail)
+    response = client.post(
+        "/users/login", json={"username": "alice", "password": "testpassword"}
+    )
+    assert response.status_code == 429
+
+
+def test_global_per_ip_limit(limited, monkeypatch):
+    monkeypatch.setattr(ratelimit, "global_limit", ratelimit.parse_limit("3/60"))
+    statuses = [client.get("/pot/").status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
@@ -1,24 +1,35 @@
+import asyncio
+import time
+
 import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from passlib.context import CryptContext
+from sqlalchemy import create_engine, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from main import app
+from app.core import auth, events, hashing
 from app.db.database import Base, get_db
+from app.db.models import User
 
 # Setup test database (in-memory SQLite)
 TEST_DATABASE_URL = "sqlite:///./test.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 
 engine = create_engine(TEST_DATABASE_URL, connect_args={"check_same_thread": False})
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(
+    autoflush=False, expire_on_commit=False, bind=async_engine
+)
 
 
 # Override the database dependency
-def override_get_db():
-    db = TestingSessionLocal()
-    try:
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
@@ -35,6 +46,7 @@ def clear_database():
     # Clear the database before each test
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    auth.revoked_users.clear()
 
 
 def test_register_user(clear_database):
@@ -88,3 +100,102 @@ def test_login_nonexistent_user(clear_database):
     )
     assert response.status_code == 401
     assert response.json()["detail"] == "Invalid credentials"
+
+
+def test_logout_revokes_issued_tokens(clear_database):
+    response = client.post(
+        "/users/register", json={"username": "testuser", "password": "testpassword"}
+    )
+    token = response.json()["access_token"]
+    response = client.post(
+        "/users/logout", headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+
+    response = client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token revoked"
+
+    response = client.post(
+        "/users/login", json={"username": "testuser", "password": "testpassword"}
+    )
+    token = response.json()["access_token"]
+    response = client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+
+
+def test_stateless_auth_trusts_token_claims(clear_database, monkeypatch):
+    monkeypatch.setattr(auth, "STATELESS_AUTH", True)
+    response = client.post(
+        "/users/register", json={"username": "testuser", "password": "testpassword"}
+    )
+    token = response.json()["access_token"]
+
+    # No session is needed when the claims are trusted
+    current_user = asyncio.run(auth.get_current_user(token, db=None))
+    assert current_user["username"] == "testuser"
+
+    auth.revoke_tokens(current_user["id"])
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(auth.get_current_user(token, db=None))
+    assert excinfo.value.status_code == 401
+
+
+def test_stateless_auth_checks_tokens_older_than_an_event_reconnect(
+    clear_database, monkeypatch
+):
+    monkeypatch.setattr(auth, "STATELESS_AUTH", True)
+    response = client.post(
+        "/users/register", json={"username": "testuser", "password": "testpassword"}
+    )
+    token = response.json()["access_token"]
+    # A logout in another worker while this one's event connection was down
+    db = TestingSessionLocal()
+    db.execute(update(User).values(token_version=User.token_version + 1))
+    db.commit()
+    db.close()
+
+    # The token predates the reconnect, so the database is asked again
+    monkeypatch.setattr(auth, "_revocations_missed_before", 0.0)
+    events.hub._resync()
+    assert auth._revocations_missed_before > time.time() - 5
+
+    async def current_user():
+        async with TestingAsyncSessionLocal() as db:
+            return await auth.get_current_user(token, db)
+
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(current_user())
+    assert excinfo.value.detail == "Token revoked"
+
+
+def test_login_rehashes_password_when_cost_changes(clear_database):
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=4).hash(
+        "testpassword"
+    )
+    db = TestingSessionLocal()
+    db.add(User(username="testuser", hashed_password=old_hash))
+    db.commit()
+
+    response = client.post(
+        "/users/login", json={"username": "testuser", "password": "testpassword"}
+    )
+    assert response.status_code == 200
+
+    new_hash = db.query(User).filter(User.username == "testuser").one().hashed_password
+    db.close()
+    assert new_hash != old_hash
+    assert not hashing.pwd_context.needs_update(new_hash)
+    assert hashing.verify_password("testpassword", new_hash)
+
+
+def test_login_returns_503_when_hashing_queue_is_full(clear_database, monkeypatch):
+    client.post(
+        "/users/register", json={"username": "testuser", "password": "testpassword"}
+    )
+    monkeypatch.setattr(hashing, "HASH_QUEUE_LIMIT", 0)
+    response = client.post(
+        "/users/login", json={"username": "testuser", "password": "testpassword"}
+    )
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers